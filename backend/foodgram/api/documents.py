@@ -0,0 +1,136 @@
+import json
+import threading
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import router, transaction
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+
+from recipes.models import Recipe, RecipeDocument
+from .filters import RECIPE_ORDERINGS
+from .serializers import RecipeSerializer
+
+# Поля текущего пользователя накладываются на документ при чтении
+USER_FIELDS = ('is_favorited', 'is_in_shopping_cart')
+# Сами рецепты читаются только ради флагов и полей сортировки
+PAGE_FIELDS = sorted({'id', 'author'} | {
+    field.lstrip('-')
+    for ordering in RECIPE_ORDERINGS.values() for field in ordering})
+BATCH_SIZE = 500
+
+_pending = threading.local()
+
+
+def build_documents(recipe_ids):
+    """Документы рецептов в виде JSON: вывод RecipeSerializer без
+    запроса, поэтому ссылки относительные, и без флагов пользователя."""
+    recipes = Recipe.objects.optimized_for(AnonymousUser()).filter(
+        pk__in=recipe_ids)
+    documents = {}
+    for data in RecipeSerializer(recipes, many=True).data:
+        for field in USER_FIELDS:
+            del data[field]
+        del data['author']['is_subscribed']
+        documents[data['id']] = json.dumps(data, ensure_ascii=False)
+    return documents
+
+
+def refresh_recipe_documents(recipe_ids):
+    """Пересобирает документы рецептов и возвращает их по id.
+
+    Строки рецептов блокируются на время сборки, чтобы параллельная
+    пересборка не записала документ по более старому состоянию."""
+    recipe_ids = sorted({int(pk) for pk in recipe_ids})
+    database = router.db_for_write(RecipeDocument)
+    built = {}
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        batch = recipe_ids[start:start + BATCH_SIZE]
+        with transaction.atomic(using=database):
+            list(Recipe.objects.using(database).select_for_update().filter(
+                pk__in=batch).values_list('pk', flat=True))
+            documents = build_documents(batch)
+            RecipeDocument.objects.using(database).filter(
+                recipe_id__in=batch).delete()
+            RecipeDocument.objects.using(database).bulk_create(
+                RecipeDocument(recipe_id=pk, body=body)
+                for pk, body in documents.items())
+        built.update(documents)
+    return built
+
+
+def refresh_documents_on_commit(get_recipe_ids):
+    """Пересобирает документы после коммита. Все изменения транзакции
+    собираются в один вызов: создание рецепта меняет и сам рецепт,
+    и теги, и состав."""
+    getters = getattr(_pending, 'getters', None)
+    if getters is None:
+        getters = _pending.getters = []
+    getters.append(get_recipe_ids)
+    transaction.on_commit(flush_document_refreshes)
+
+
+def flush_document_refreshes():
+    getters = getattr(_pending, 'getters', None)
+    _pending.getters = []
+    if getters:
+        refresh_recipe_documents(
+            {pk for get_recipe_ids in getters for pk in get_recipe_ids()})
+
+
+def absolute_url(prefix, url):
+    if url and url.startswith('/') and not url.startswith('//'):
+        return prefix + url
+    return url
+
+
+def render_documents(recipes, request):
+    """Ответ RecipeSerializer для рецептов из with_document_flags:
+    документы читаются одним запросом, недостающие собираются на месте,
+    поверх накладываются флаги пользователя и домен ссылок."""
+    recipes = list(recipes)
+    bodies = dict(RecipeDocument.objects.filter(
+        recipe_id__in=[recipe.pk for recipe in recipes]
+    ).values_list('recipe_id', 'body'))
+    missing = [recipe.pk for recipe in recipes if recipe.pk not in bodies]
+    if missing:
+        bodies.update(refresh_recipe_documents(missing))
+    prefix = ''
+    if request is not None:
+        prefix = request.build_absolute_uri('/')[:-1]
+    results = []
+    for recipe in recipes:
+        body = bodies.get(recipe.pk)
+        if body is None:
+            continue
+        data = json.loads(body)
+        data['author']['is_subscribed'] = getattr(
+            recipe, 'is_subscribed', False)
+        data['image'] = absolute_url(prefix, data['image'])
+        if data['image_renditions']:
+            data['image_renditions'] = {
+                name: absolute_url(prefix, url)
+                for name, url in data['image_renditions'].items()}
+        for field in USER_FIELDS:
+            data[field] = getattr(recipe, field, False)
+        results.append(data)
+    return results
+
+
+class RecipeDocumentListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        return render_documents(data, self.context.get('request'))
+
+
+class RecipeDocumentSerializer(serializers.BaseSerializer):
+    """Рецепт из готового документа: тот же ответ, что у RecipeSerializer,
+    но без вложенных сериализаторов на каждый объект."""
+
+    class Meta:
+        list_serializer_class = RecipeDocumentListSerializer
+
+    def to_representation(self, instance):
+        documents = render_documents([instance], self.context.get('request'))
+        if not documents:
+            raise NotFound()
+        return documents[0]
@@ -0,0 +1,117 @@
+import csv
+import io
+import os
+from abc import ABCMeta, abstractmethod
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+except ImportError:
+    canvas = None
+
+
+class BaseExporter(BaseRenderer, metaclass=ABCMeta):
+    """Экспортёр списка покупок.
+
+    Экспортёры подключаются к экшену как рендереры DRF, поэтому формат
+    выбирается обычным согласованием: ?format=txt|csv|pdf или Accept.
+    Сам документ отдаётся потоком из stream(), а render() нужен только
+    для ответов с ошибками."""
+    charset = 'utf-8'
+    title = 'Список покупок'
+    available = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data)
+
+    @abstractmethod
+    def stream(self, rows):
+        """Генератор частей документа по строкам (name, unit, amount)."""
+
+    @property
+    def filename(self):
+        return f'shopping_list.{self.format}'
+
+
+class TxtExporter(BaseExporter):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        yield f'{self.title}:\n'
+        for name, measure, amount in rows:
+            yield f'- {name} в количестве: {amount} {measure},\n'
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает строку вместо записи."""
+
+    @staticmethod
+    def write(value):
+        return value
+
+
+class CsvExporter(BaseExporter):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('Ингредиент', 'Единица измерения',
+                               'Количество'))
+        for row in rows:
+            yield writer.writerow(row)
+
+
+class PdfExporter(BaseExporter):
+    """PDF собирается целиком в памяти: таблица ссылок в конце файла
+    не позволяет отдавать его частями. Нужен reportlab и TTF-шрифт
+    с кириллицей (SHOPPING_LIST_PDF_FONT)."""
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    available = canvas is not None
+    font_name = 'ShoppingListFont'
+    font_size = 12
+
+    def get_font(self):
+        if self.font_name in pdfmetrics.getRegisteredFontNames():
+            return self.font_name
+        path = settings.SHOPPING_LIST_PDF_FONT
+        if not os.path.exists(path):
+            return 'Helvetica'
+        pdfmetrics.registerFont(TTFont(self.font_name, path))
+        return self.font_name
+
+    def stream(self, rows):
+        buffer = io.BytesIO()
+        document = canvas.Canvas(buffer, pagesize=A4)
+        font = self.get_font()
+        width, height = A4
+        margin = 50
+        line_height = self.font_size * 1.5
+        y = height - margin
+        document.setFont(font, self.font_size + 4)
+        document.drawString(margin, y, self.title)
+        y -= line_height * 2
+        document.setFont(font, self.font_size)
+        for name, measure, amount in rows:
+            if y < margin:
+                document.showPage()
+                document.setFont(font, self.font_size)
+                y = height - margin
+            document.drawString(margin, y, f'- {name}: {amount} {measure}')
+            y -= line_height
+        document.save()
+        yield buffer.getvalue()
+
+
+EXPORTERS = tuple(
+    exporter for exporter in (TxtExporter, CsvExporter, PdfExporter)
+    if exporter.available
+)
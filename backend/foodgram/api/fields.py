@@ -1,16 +1,78 @@
 import base64
+import binascii
+import hashlib
+from tempfile import SpooledTemporaryFile
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from rest_framework import serializers
 from rest_framework.serializers import ImageField
 
+from recipes.models import Recipe
+from recipes.renditions import get_rendition_urls
+
+ALLOWED_IMAGE_TYPES = ('jpeg', 'jpg', 'png', 'gif', 'webp')
+DECODE_CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_SIZE = 1024 * 1024
+
 
 class Base64ImageField(ImageField):
-    """Сериализатор для кодирования картинок"""
+    """Сериализатор для кодирования картинок.
+
+    data URI декодируется частями во временный файл с проверкой размера
+    до декодирования. Файл называется по sha256 содержимого: если такая
+    картинка уже загружена, возвращается имя существующего файла."""
 
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-
+            data = self.decode(data)
+            if isinstance(data, str):
+                return data
         return super().to_internal_value(data)
+
+    @staticmethod
+    def decode(data):
+        header, _, payload = data.partition(';base64,')
+        ext = header.split('/')[-1].lower()
+        if not payload or ext not in ALLOWED_IMAGE_TYPES:
+            raise serializers.ValidationError(
+                'Некорректный формат изображения.')
+        limit = settings.MAX_IMAGE_UPLOAD_SIZE
+        if len(payload) * 3 // 4 > limit:
+            raise serializers.ValidationError(
+                f'Размер изображения не должен превышать {limit} байт.')
+        digest = hashlib.sha256()
+        file = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        for start in range(0, len(payload), DECODE_CHUNK_SIZE):
+            try:
+                chunk = base64.b64decode(
+                    payload[start:start + DECODE_CHUNK_SIZE], validate=True)
+            except binascii.Error:
+                file.close()
+                raise serializers.ValidationError(
+                    'Некорректные данные изображения.')
+            digest.update(chunk)
+            file.write(chunk)
+        name = f'{digest.hexdigest()[:32]}.{ext}'
+        path = Recipe._meta.get_field('image').generate_filename(None, name)
+        if default_storage.exists(path):
+            file.close()
+            return path
+        file.seek(0)
+        return File(file, name=name)
+
+
+class ImageRenditionsField(serializers.ReadOnlyField):
+    """Ссылки на уменьшенные WebP-версии картинки рецепта. Источник —
+    сам рецепт: нужны и картинка, и отметки о готовых версиях."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return None
+        return get_rendition_urls(recipe.image.name, recipe.renditions,
+                                  self.context.get('request'))
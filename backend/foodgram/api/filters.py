@@ -1,34 +1,149 @@
+from django import forms
+from django.conf import settings
+from django.core.cache import cache
 from django_filters.rest_framework import FilterSet, filters
 from rest_framework.filters import SearchFilter
 
+from foodgram.routers import fresh_reads
+from recipes.cache import TAGS_NAMESPACE, get_version
 from recipes.models import Recipe, Tag
+from recipes.search import search_recipes
 
 
 class IngredientFilter(SearchFilter):
+    """Поиск ингредиентов по началу названия в базе. Используется,
+    когда индекс в памяти отключён (INGREDIENT_INDEX_ENABLED)."""
     search_param = 'name'
+    limit_param = 'limit'
+
+    def get_search_terms(self, request):
+        # Вся строка — один префикс, как и в индексе автодополнения
+        term = request.query_params.get(self.search_param, '').strip()
+        return [term] if term else []
+
+    def get_limit(self, request):
+        limit = request.query_params.get(self.limit_param, '')
+        if limit.isdigit() and 0 < int(limit):
+            return min(int(limit), settings.INGREDIENT_SEARCH_LIMIT)
+        return settings.INGREDIENT_SEARCH_LIMIT
+
+    def filter_queryset(self, request, queryset, view):
+        queryset = super().filter_queryset(request, queryset, view)
+        if self.get_search_terms(request):
+            return queryset[:self.get_limit(request)]
+        return queryset
+
+
+RECIPE_ORDERINGS = {
+    'newest': ('-pub_date', '-id'),
+    'popular': ('-favorites_count', '-pub_date', '-id'),
+    'trending': ('-trending_score', '-pub_date', '-id'),
+    'cooking_time': ('cooking_time', '-pub_date', '-id'),
+}
+
+
+def get_tag_ids_by_slug():
+    """Словарь slug → id тегов из кеша; версию повышают сигналы Tag."""
+    key = f'tag_slugs:{get_version(TAGS_NAMESPACE)}'
+    slugs = cache.get(key)
+    if slugs is None:
+        with fresh_reads(TAGS_NAMESPACE):
+            slugs = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, slugs, settings.REFERENCE_CACHE_TIMEOUT)
+    return slugs
+
+
+class SlugListWidget(forms.Widget):
+    """Повторяющийся параметр и/или значения через запятую."""
+
+    def value_from_datadict(self, data, files, name):
+        getlist = getattr(data, 'getlist', None)
+        values = getlist(name) if getlist else [data.get(name) or '']
+        return sorted({slug.strip() for value in values
+                       for slug in value.split(',') if slug.strip()})
+
+
+class SlugListField(forms.Field):
+    widget = SlugListWidget
+
+
+class TagsFilter(filters.Filter):
+    """Фильтр по slug тегов: ?tags=lunch&tags=dinner или ?tags=lunch,dinner.
+
+    Теги проверяются полусоединением id IN (SELECT recipe_id ...) по
+    таблице связей вместо JOIN, поэтому рецепты не дублируются и DISTINCT
+    не нужен. В отличие от коррелированного EXISTS такой подзапрос SQLite
+    тоже выполняет один раз. С tags_mode=all рецепт должен иметь все теги,
+    по умолчанию — хотя бы один. Неизвестные slug ничему не соответствуют."""
+    field_class = SlugListField
+
+    def filter(self, queryset, value):
+        if not value:
+            return queryset
+        tag_ids_by_slug = get_tag_ids_by_slug()
+        tag_ids = [tag_ids_by_slug.get(slug) for slug in value]
+        links = Recipe.tags.through.objects.values('recipe_id')
+        if self.parent.form.cleaned_data.get('tags_mode') == 'all':
+            if None in tag_ids:
+                return queryset.none()
+            for tag_id in tag_ids:
+                queryset = queryset.filter(
+                    pk__in=links.filter(tag_id=tag_id))
+            return queryset
+        tag_ids = [tag_id for tag_id in tag_ids if tag_id is not None]
+        if not tag_ids:
+            return queryset.none()
+        return queryset.filter(pk__in=links.filter(tag_id__in=tag_ids))
 
 
 class RecipesFilter(FilterSet):
     author = filters.NumberFilter(field_name='author__id')
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
-    )
+    tags = TagsFilter()
+    tags_mode = filters.ChoiceFilter(
+        choices=(('any', 'Хотя бы один из тегов'), ('all', 'Все теги')),
+        method='get_tags_mode')
     is_favorited = filters.NumberFilter(method='get_is_favorited')
     is_in_shopping_cart = filters.NumberFilter(
         method='get_is_in_shopping_cart')
+    search = filters.CharFilter(method='get_search')
+    ordering = filters.ChoiceFilter(
+        choices=(
+            ('newest', 'Сначала новые'),
+            ('popular', 'По числу добавлений в избранное'),
+            ('trending', 'По популярности за последнее время'),
+            ('cooking_time', 'По времени приготовления'),
+        ),
+        method='get_ordering')
 
     def get_is_favorited(self, queryset, name, value):
         if value and not self.request.user.is_anonymous:
-            return queryset.filter(in_favorites__user=self.request.user)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         if value and not self.request.user.is_anonymous:
-            return queryset.filter(in_shopping_carts__user=self.request.user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
 
+    @staticmethod
+    def get_tags_mode(queryset, name, value):
+        # Учитывается в TagsFilter
+        return queryset
+
+    @staticmethod
+    def get_search(queryset, name, value):
+        # Результаты упорядочены по релевантности, ?ordering её заменяет
+        value = value.strip()
+        if value:
+            return search_recipes(queryset, value)
+        return queryset
+
+    @staticmethod
+    def get_ordering(queryset, name, value):
+        # Счётчики и рейтинг поддерживают сигналы, сортировка идёт по индексу
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
+
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'tags_mode', 'is_favorited',
+                  'is_in_shopping_cart', 'search', 'ordering')
@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+COUNTER_KEY = 'metrics:{}'
+VIEWS_KEY = 'metrics:views'
+
+COUNTERS = {
+    'recipe_page_cache_hits': 'Попадания в кеш страниц ленты рецептов',
+    'recipe_page_cache_misses': 'Промахи кеша страниц ленты рецептов',
+}
+
+# Счётчики запросов по экшенам. Время хранится в микросекундах, чтобы
+# его можно было складывать через cache.incr, и отдаётся в секундах.
+REQUEST_COUNTERS = {
+    'requests': 'Обработанные запросы',
+    'db_queries': 'SQL-запросы',
+    'db_seconds': 'Время SQL-запросов',
+    'render_seconds': 'Время рендеринга ответа',
+    'request_seconds': 'Полное время обработки запроса',
+    'response_bytes': 'Размер ответов',
+    'query_budget_exceeded': 'Запросы сверх бюджета SQL-запросов',
+}
+
+_pending = defaultdict(int)
+_pending_lock = threading.Lock()
+_flushed_at = time.monotonic()
+
+
+class QueryBudgetError(Exception):
+    """Экшен выполнил больше SQL-запросов, чем разрешено QUERY_BUDGETS."""
+
+
+def increment(name, value=1):
+    """Увеличивает счётчик в общем кеше: с файловым кешем он общий для
+    всех воркеров, с locmem — свой в каждом процессе."""
+    key = COUNTER_KEY.format(name)
+    try:
+        cache.incr(key, value)
+    except ValueError:
+        if not cache.add(key, value, timeout=None):
+            cache.incr(key, value)
+
+
+def record_request(view, **values):
+    """Копит метрики запроса в памяти процесса и сбрасывает их в кеш
+    не чаще раза в METRICS_FLUSH_INTERVAL секунд, чтобы запрос не платил
+    за несколько обращений к кешу."""
+    with _pending_lock:
+        for name, value in values.items():
+            _pending[view, name] += value
+        due = (time.monotonic() - _flushed_at
+               >= settings.METRICS_FLUSH_INTERVAL)
+    if due:
+        flush()
+
+
+def flush():
+    global _flushed_at
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _flushed_at = time.monotonic()
+    views = {view for view, _ in pending}
+    known = cache.get(VIEWS_KEY, set())
+    if not views <= known:
+        cache.set(VIEWS_KEY, known | views, timeout=None)
+    for (view, name), value in pending.items():
+        increment(f'{name}:{view}', value)
+
+
+def report_query_budget(view, queries, budget):
+    """Сообщает о превышении бюджета QUERY_BUDGETS; с QUERY_BUDGET_RAISE
+    бросает исключение, чтобы N+1 ронял тесты."""
+    message = f'{view}: {queries} SQL-запросов при бюджете {budget}'
+    if settings.QUERY_BUDGET_RAISE:
+        raise QueryBudgetError(message)
+    logger.warning(message)
+
+
+def get_counters():
+    values = cache.get_many([COUNTER_KEY.format(name) for name in COUNTERS])
+    return {name: values.get(COUNTER_KEY.format(name), 0)
+            for name in COUNTERS}
+
+
+def get_request_counters():
+    views = sorted(cache.get(VIEWS_KEY, set()))
+    keys = {(name, view): COUNTER_KEY.format(f'{name}:{view}')
+            for name in REQUEST_COUNTERS for view in views}
+    values = cache.get_many(list(keys.values()))
+    return {name: {view: values.get(keys[name, view], 0) for view in views}
+            for name in REQUEST_COUNTERS}
+
+
+def render_prometheus():
+    flush()
+    lines = []
+    for name, value in get_counters().items():
+        metric = f'foodgram_{name}_total'
+        lines.append(f'# HELP {metric} {COUNTERS[name]}')
+        lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric} {value}')
+    for name, values in get_request_counters().items():
+        metric = f'foodgram_{name}_total'
+        lines.append(f'# HELP {metric} {REQUEST_COUNTERS[name]}')
+        lines.append(f'# TYPE {metric} counter')
+        for view, value in values.items():
+            if name.endswith('_seconds'):
+                value = value / 1e6
+            lines.append(f'{metric}{{view="{view}"}} {value}')
+    return '\n'.join(lines) + '\n'
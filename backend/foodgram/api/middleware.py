@@ -0,0 +1,173 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from foodgram.routers import route_reads
+from .metrics import record_request, report_query_budget
+
+
+class QueryCounter:
+    """Число SQL-запросов и время в базе за один запрос к API."""
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0
+
+
+current_counters = ContextVar('query_counters', default=())
+
+
+def count_query(execute, sql, params, many, context):
+    """execute_wrapper всех соединений: пишет во все счётчики текущего
+    контекста, вложенные блоки count_queries не перехватывают запросы
+    у внешних. Контекст переходит в потоки sync_to_async и api.offload,
+    поэтому запросы из любого потока попадают в счётчик своего запроса."""
+    counters = current_counters.get()
+    if not counters:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        for counter in counters:
+            counter.queries += 1
+            counter.duration += duration
+
+
+def watch_connection(connection):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+@contextmanager
+def count_queries():
+    """Считает запросы внутри блока. Новые соединения подключает
+    сигнал connection_created, уже открытые — этот вызов."""
+    for alias in connections:
+        watch_connection(connections[alias])
+    counter = QueryCounter()
+    token = current_counters.set(current_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        current_counters.reset(token)
+
+
+def get_view_name(request, view_func):
+    """recipes.list для экшенов вьюсетов, имя класса для остальных
+    вьюх DRF. Прочие вьюхи (админка, статика) не учитываются."""
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return None
+    actions = getattr(view_func, 'actions', None)
+    if actions is None:
+        return cls.__name__
+    action = actions.get(request.method.lower(), 'metadata')
+    basename = view_func.initkwargs.get('basename') or cls.__name__
+    return f'{basename}.{action}'
+
+
+class QueryMetricsMiddleware:
+    """Считает для каждого запроса к API число SQL-запросов, время
+    в базе, время рендеринга ответа и его размер.
+
+    Метрики копятся по экшенам для /api/metrics/ и отдаются в заголовке
+    Server-Timing: всем клиентам с SERVER_TIMING, иначе только
+    сотрудникам. Число запросов сверяется с бюджетом QUERY_BUDGETS.
+    Запросы потоковых ответов, выполненные уже при отдаче тела,
+    не учитываются."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with count_queries() as counter:
+            response = self.get_response(request)
+        return self.finish(request, response, counter, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with count_queries() as counter:
+            response = await self.get_response(request)
+        return self.finish(request, response, counter, started)
+
+    def finish(self, request, response, counter, started):
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is None:
+            return response
+        view = get_view_name(request, resolver_match.func)
+        if view is None:
+            return response
+        duration = time.perf_counter() - started
+        render = getattr(request, 'metrics_render', 0)
+        size = 0 if response.streaming else len(response.content)
+        # Время в базе раскрывает устройство запросов, поэтому без
+        # SERVER_TIMING заголовок видят только сотрудники
+        user = getattr(request, 'user', None)
+        if settings.SERVER_TIMING or getattr(user, 'is_staff', False):
+            response['Server-Timing'] = (
+                f'db;dur={counter.duration * 1000:.2f};'
+                f'desc="{counter.queries} queries", '
+                f'render;dur={render * 1000:.2f}, '
+                f'total;dur={duration * 1000:.2f}')
+        budget = settings.QUERY_BUDGETS.get(view)
+        exceeded = budget is not None and counter.queries > budget
+        record_request(
+            view, requests=1, db_queries=counter.queries,
+            db_seconds=round(counter.duration * 1e6),
+            render_seconds=round(render * 1e6),
+            request_seconds=round(duration * 1e6),
+            response_bytes=size, query_budget_exceeded=int(exceeded))
+        if exceeded:
+            report_query_budget(view, counter.queries, budget)
+        return response
+
+    def process_template_response(self, request, response):
+        # Ответы DRF рендерятся после этого хука. Под ASGI ответ уже
+        # отрендерен в потоке вьюхи, и время записано там.
+        if response.is_rendered:
+            return response
+        started = time.perf_counter()
+
+        def measure(rendered):
+            request.metrics_render = time.perf_counter() - started
+
+        response.add_post_render_callback(measure)
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """Отправляет чтение безопасных запросов на реплики, а клиентов,
+    которые недавно писали, — на основную базу, см. foodgram.routers."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with route_reads(request):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with route_reads(request):
+            return await self.get_response(request)
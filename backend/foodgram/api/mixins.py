@@ -0,0 +1,140 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from rest_framework.response import Response
+
+from foodgram.routers import fresh_reads
+from recipes.cache import RECIPES_NAMESPACE, get_version, user_namespace
+from recipes.models import Recipe
+from users.models import Subscription
+from .metrics import increment
+
+
+class CachedResponseMixin:
+    """Кеширует ответы list/retrieve справочных вьюсетов.
+
+    Ключ и ETag строятся из версии cache_namespace и полного пути запроса.
+    Версию повышают сигналы при изменении данных, поэтому старые записи
+    просто перестают читаться. Ответ не зависит от пользователя."""
+    cache_namespace = None
+
+    def cached_response(self, request, build_data):
+        version = get_version(self.cache_namespace)
+        path = hashlib.md5(
+            request.get_full_path().encode('utf-8')).hexdigest()
+        etag = quote_etag(f'{self.cache_namespace}-{version}-{path}')
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            key = f'response:{self.cache_namespace}:{version}:{path}'
+            data = cache.get(key)
+            if data is None:
+                with fresh_reads(self.cache_namespace):
+                    data = build_data()
+                cache.set(key, data, settings.REFERENCE_CACHE_TIMEOUT)
+            response = Response(data)
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CachedResponseMixin, self).list(
+                request, *args, **kwargs).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CachedResponseMixin, self).retrieve(
+                request, *args, **kwargs).data)
+
+
+class CachedRecipePagesMixin:
+    """Кеширует страницы ленты рецептов.
+
+    Страница без фильтров по избранному и корзине одинакова для всех:
+    она собирается как для анонима и кешируется один раз, а флаги
+    is_favorited, is_in_shopping_cart и is_subscribed текущего пользователя
+    накладываются поверх одним запросом. Страницы с этими фильтрами
+    кешируются для каждого пользователя отдельно. Ключ включает поколение
+    рецептов и поколение пользователя, которые повышают сигналы."""
+    page_cache_params = ('author', 'tags', 'tags_mode', 'is_favorited',
+                         'is_in_shopping_cart', 'page', 'limit',
+                         'cursor', 'count', 'ordering', 'search')
+    personal_params = ('is_favorited', 'is_in_shopping_cart')
+
+    @property
+    def flags_user(self):
+        return getattr(self, '_flags_user', self.request.user)
+
+    def is_personal_page(self, request):
+        return request.user.is_authenticated and any(
+            request.query_params.get(param, '0') not in ('', '0')
+            for param in self.personal_params)
+
+    def get_page_cache_key(self, request, personal):
+        params = [
+            (param, sorted(request.query_params.getlist(param)))
+            for param in self.page_cache_params
+        ]
+        if not request.query_params.get('page'):
+            params[self.page_cache_params.index('page')] = ('page', ['1'])
+        parts = [request.get_host(), repr(params),
+                 get_version(RECIPES_NAMESPACE)]
+        if personal:
+            parts += [request.user.pk,
+                      get_version(user_namespace(request.user.pk))]
+        digest = hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+        return f'recipe_page:{digest}'
+
+    def list(self, request, *args, **kwargs):
+        if not settings.RECIPE_PAGE_CACHE_TIMEOUT:
+            return super().list(request, *args, **kwargs)
+        personal = self.is_personal_page(request)
+        key = self.get_page_cache_key(request, personal)
+        data = cache.get(key)
+        if data is None:
+            increment('recipe_page_cache_misses')
+            if not personal:
+                self._flags_user = AnonymousUser()
+            namespaces = [RECIPES_NAMESPACE]
+            if personal:
+                namespaces.append(user_namespace(request.user.pk))
+            with fresh_reads(*namespaces):
+                data = super().list(request, *args, **kwargs).data
+            cache.set(key, data, settings.RECIPE_PAGE_CACHE_TIMEOUT)
+        else:
+            increment('recipe_page_cache_hits')
+        if not personal and request.user.is_authenticated:
+            data = self.apply_user_flags(data, request.user)
+        return Response(data)
+
+    @staticmethod
+    def apply_user_flags(data, user):
+        results = data['results']
+        flags = {
+            pk: (is_favorited, is_in_shopping_cart, is_subscribed)
+            for pk, is_favorited, is_in_shopping_cart, is_subscribed in
+            Recipe.objects.filter(
+                pk__in=[recipe['id'] for recipe in results]
+            ).with_user_flags(user).annotate(
+                is_subscribed=Exists(Subscription.objects.filter(
+                    user=user, author=OuterRef('author')))
+            ).values_list('pk', 'is_favorited', 'is_in_shopping_cart',
+                          'is_subscribed').order_by()
+        }
+        overlaid = []
+        for recipe in results:
+            is_favorited, is_in_shopping_cart, is_subscribed = flags.get(
+                recipe['id'], (False, False, False))
+            overlaid.append({
+                **recipe,
+                'author': {**recipe['author'],
+                           'is_subscribed': is_subscribed},
+                'is_favorited': is_favorited,
+                'is_in_shopping_cart': is_in_shopping_cart,
+            })
+        return {**data, 'results': overlaid}
@@ -0,0 +1,101 @@
+import asyncio
+import contextvars
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Каждый поток держит своё соединение с базой, поэтому размер пула —
+# это и число соединений на процесс
+executor = ThreadPoolExecutor(max_workers=settings.ASGI_READ_THREADS,
+                              thread_name_prefix='read')
+
+
+def call_view(view, request, args, kwargs):
+    """Выполняет синхронную вьюху и рендерит ответ в том же потоке:
+    рендеринг DRF читает базу, а в цикле событий Django 3.2 это
+    запрещено. Потоковое тело читает StreamingASGIHandler."""
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            started = time.perf_counter()
+            response.render()
+            request.metrics_render = time.perf_counter() - started
+    finally:
+        close_old_connections()
+    return response
+
+
+def offload_reads(view):
+    """Асинхронная обёртка для вьюх под ASGI.
+
+    Чтение выполняется в пуле из ASGI_READ_THREADS потоков, так что
+    медленный запрос не задерживает остальные. Запись идёт, как
+    и у обычных синхронных вьюх, через общий поток thread_sensitive:
+    там её транзакции и сигналы работают как под WSGI."""
+    write = sync_to_async(call_view, thread_sensitive=True)
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in READ_METHODS:
+            return await write(view, request, args, kwargs)
+        context = contextvars.copy_context()
+        return await asyncio.get_event_loop().run_in_executor(
+            executor, functools.partial(
+                context.run, call_view, view, request, args, kwargs))
+
+    return wrapper
+
+
+def encode(value, charset):
+    return value.encode(charset) if isinstance(value, str) else bytes(value)
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """ASGIHandler Django 3.2 перебирает тело потокового ответа прямо
+    в цикле событий, где читать базу нельзя.
+
+    Здесь каждая часть тела берётся в общем потоке thread_sensitive:
+    тело не собирается в памяти целиком, а курсор QuerySet.iterator,
+    открытый при чтении первой части, всё время работает в одном потоке
+    и с одним соединением. Между частями поток свободен для записи."""
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        headers = [
+            (encode(header, 'ascii'), encode(value, 'latin1'))
+            for header, value in response.items()
+        ]
+        headers += [
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            for cookie in response.cookies.values()
+        ]
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': headers,
+        })
+        parts = iter(response)
+        next_part = sync_to_async(next, thread_sensitive=True)
+        try:
+            while True:
+                part = await next_part(parts, None)
+                if part is None:
+                    break
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+            await send({'type': 'http.response.body'})
+        finally:
+            await sync_to_async(response.close, thread_sensitive=True)()
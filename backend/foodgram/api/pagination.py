@@ -1,10 +1,191 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import datetime
+from functools import reduce
+from operator import or_
 
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
-class CustomRecipesPagination(PageNumberPagination):
-    page_size = 6
+from .filters import RECIPE_ORDERINGS
 
 
 class CustomUsersPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     page_size = 6
+
+
+def invert(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+def keyset_filter(ordering, values):
+    """Строки после строки с ключом values в порядке ordering: для
+    ('-pub_date', '-id') это pub_date <= p AND (pub_date < p OR
+    pub_date = p AND id < i). Первое условие даёт границу по индексу."""
+    conditions = []
+    for position, field in enumerate(ordering):
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        equal = {name.lstrip('-'): value for name, value in zip(
+            ordering[:position], values)}
+        conditions.append(Q(**equal, **{
+            f'{field.lstrip("-")}__{lookup}': values[position]}))
+    first = ordering[0]
+    bound = 'lte' if first.startswith('-') else 'gte'
+    return (Q(**{f'{first.lstrip("-")}__{bound}': values[0]})
+            & reduce(or_, conditions))
+
+
+class KeysetPagination(CustomUsersPagination):
+    """Постраничная пагинация с двумя дополнительными режимами.
+
+    ?cursor= (в том числе пустой) включает курсорную пагинацию по
+    cursor_ordering: курсор хранит значения всех полей порядка у крайней
+    строки, и страница выбирается условием по ним без OFFSET и COUNT(*).
+    Если get_cursor_ordering вернул None, параметр игнорируется.
+    ?count=false в обычном режиме не считает общее число записей:
+    читается одна лишняя строка, чтобы узнать, есть ли следующая
+    страница, а count в ответе равен null. Без этих параметров ответ
+    тот же, что и у CustomUsersPagination."""
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    cursor_ordering = ('-id',)
+    invalid_cursor_message = 'Неверный курсор'
+
+    def get_cursor_ordering(self, request):
+        return self.cursor_ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_ordering_used = None
+        self.counted = True
+        if self.cursor_query_param in request.query_params:
+            ordering = self.get_cursor_ordering(request)
+            if ordering is not None:
+                return self.paginate_by_cursor(queryset, request, ordering)
+        count = request.query_params.get(self.count_query_param)
+        if count in ('false', '0'):
+            self.counted = False
+            return self.paginate_without_count(queryset, request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_by_cursor(self, queryset, request, ordering):
+        self.request = request
+        self.cursor_ordering_used = ordering
+        page_size = self.get_page_size(request)
+        values, reverse = self.decode_cursor(request, len(ordering))
+        if reverse:
+            ordering = tuple(map(invert, ordering))
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(keyset_filter(ordering, values))
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+        # Строка курсора осталась позади: в её сторону страница есть
+        self.has_next = values is not None if reverse else has_more
+        self.has_previous = has_more if reverse else values is not None
+        self.page_rows = rows
+        return rows
+
+    def decode_cursor(self, request, length):
+        """Значения ключа и направление из ?cursor=; (None, False) для
+        первой страницы."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(
+                encoded.encode('ascii')).decode('utf-8'))
+            values, reverse = cursor['v'], bool(cursor.get('r'))
+        except (binascii.Error, UnicodeError, ValueError, KeyError,
+                TypeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != length:
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def encode_cursor(self, row, reverse):
+        values = []
+        for field in self.cursor_ordering_used:
+            value = getattr(row, field.lstrip('-'))
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            values.append(value)
+        cursor = {'v': values}
+        if reverse:
+            cursor['r'] = 1
+        encoded = base64.urlsafe_b64encode(
+            json.dumps(cursor, separators=(',', ':')).encode('utf-8'))
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            encoded.decode('ascii'))
+
+    def paginate_without_count(self, queryset, request):
+        page_size = self.get_page_size(request)
+        page_number = request.query_params.get(self.page_query_param) or '1'
+        if not page_number.isdigit() or int(page_number) < 1:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message='Неверный номер страницы'))
+        self.request = request
+        self.page_number = int(page_number)
+        offset = (self.page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        self.has_next = len(rows) > page_size
+        return rows[:page_size]
+
+    def get_paginated_response(self, data):
+        if self.cursor_ordering_used is not None:
+            rows = self.page_rows
+            return Response(OrderedDict([
+                ('next', self.encode_cursor(rows[-1], reverse=False)
+                 if self.has_next and rows else None),
+                ('previous', self.encode_cursor(rows[0], reverse=True)
+                 if self.has_previous and rows else None),
+                ('results', data),
+            ]))
+        if self.counted:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', None),
+            ('next', self.get_uncounted_link(self.page_number + 1)
+             if self.has_next else None),
+            ('previous', self.get_uncounted_link(self.page_number - 1)
+             if self.page_number > 1 else None),
+            ('results', data),
+        ]))
+
+    def get_uncounted_link(self, page_number):
+        url = self.request.build_absolute_uri()
+        if page_number == 1:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, page_number)
+
+
+class CustomRecipesPagination(KeysetPagination):
+    cursor_ordering = RECIPE_ORDERINGS['newest']
+
+    def get_cursor_ordering(self, request):
+        # Курсор хранит ключ последней строки. Число добавлений и рейтинг
+        # меняются, и страницы по ним пропускали бы и повторяли рецепты,
+        # поэтому курсор есть только у порядка по дате публикации.
+        # Результаты поиска упорядочены по релевантности, которой в ключе
+        # нет: молча подменять её порядком по дате нельзя
+        if request.query_params.get('search', '').strip():
+            raise ValidationError({self.cursor_query_param: [
+                'Курсорная пагинация недоступна вместе с поиском.']})
+        ordering = RECIPE_ORDERINGS.get(request.query_params.get('ordering'),
+                                        self.cursor_ordering)
+        if ordering != self.cursor_ordering:
+            return None
+        return ordering
+
+
+class SubscriptionsPagination(KeysetPagination):
+    cursor_ordering = ('id',)
@@ -0,0 +1,12 @@
+from rest_framework.renderers import BaseRenderer
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        return str(data).encode(self.charset)
@@ -1,13 +1,19 @@
 import re
+from functools import partial
 
+from django.conf import settings
+from django.db import transaction
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers
 from rest_framework.fields import ReadOnlyField
 
+from recipes.matching import record_change
 from recipes.models import (Favorite, Ingredient, Recipe,
-                            RecipeIngredientAmount, ShoppingCart, Tag)
+                            RecipeIngredientAmount, ShoppingCart,
+                            ShoppingListItem, Tag)
+from recipes.shopping_list import change_recipe
 from users.models import User
-from .fields import Base64ImageField
+from .fields import Base64ImageField, ImageRenditionsField
 from .utils import check_subscribed
 
 
@@ -49,6 +55,19 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         fields = 'id', 'name', 'measurement_unit', 'amount'
 
 
+class ShoppingListItemSerializer(serializers.ModelSerializer):
+    """Строка списка покупок: ингредиент и его количество во всех
+    рецептах корзины."""
+    id = ReadOnlyField(source='ingredient.id')
+    name = ReadOnlyField(source='ingredient.name')
+    measurement_unit = ReadOnlyField(source='ingredient.measurement_unit')
+    amount = ReadOnlyField(source='total_amount')
+
+    class Meta:
+        model = ShoppingListItem
+        fields = 'id', 'name', 'measurement_unit', 'amount'
+
+
 class UsersSerializer(UserSerializer):
     """Сериализатор для пользователей(наследуется от djoser)"""
     is_subscribed = serializers.SerializerMethodField()
@@ -69,25 +88,30 @@ class RecipeSerializer(serializers.ModelSerializer):
                                                source='recipes')
     tags = TagSerializer(many=True)
     image = Base64ImageField()
+    image_renditions = ImageRenditionsField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
+    def get_user_flag(self, obj, field, model):
+        # Флаг вычисляется в RecipeQuerySet.with_user_flags; рецепт без
+        # аннотации (вне ленты) проверяется отдельным запросом
+        if hasattr(obj, field):
+            return getattr(obj, field)
+        request = self.context.get('request')
+        if request is None or request.user.is_anonymous:
+            return False
+        return model.objects.filter(user=request.user, recipe=obj).exists()
+
     def get_is_favorited(self, obj):
-        return (self.context.get('request')
-                and not self.context.get('request').user.is_anonymous
-                and self.context.get('request').user.favorites.filter(
-                    recipe=obj).exists())
+        return self.get_user_flag(obj, 'is_favorited', Favorite)
 
     def get_is_in_shopping_cart(self, obj):
-        return (self.context.get('request')
-                and not self.context.get('request').user.is_anonymous
-                and self.context.get('request').user.shopping_carts.filter(
-                    recipe=obj).exists())
+        return self.get_user_flag(obj, 'is_in_shopping_cart', ShoppingCart)
 
     class Meta:
         model = Recipe
-        fields = ('id', 'tags', 'author', 'name', 'image', 'text',
-                  'ingredients', 'cooking_time',
+        fields = ('id', 'tags', 'author', 'name', 'image',
+                  'image_renditions', 'text', 'ingredients', 'cooking_time',
                   'is_favorited', 'is_in_shopping_cart')
 
 
@@ -163,7 +187,14 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                 amount=ingredient['amount']
             ) for ingredient in ingredients]
         )
-
+        # bulk_create не отправляет сигналы
+        transaction.on_commit(partial(record_change, [recipe.pk]))
+        change_recipe(recipe.pk, {
+            ingredient['id']: (ingredient['amount'], 1)
+            for ingredient in ingredients
+        }, 1)
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
@@ -172,6 +203,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         self.save_ingredients(recipe, ingredients)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         if 'ingredients' in validated_data:
             ingredients = validated_data.pop('ingredients')
@@ -184,16 +216,29 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             instance, validated_data)
 
     def to_representation(self, instance):
-        context = {'request': self.context.get('request')}
+        request = self.context.get('request')
+        instance = Recipe.objects.optimized_for(request.user).get(
+            pk=instance.pk)
+        context = {'request': request}
         return RecipeSerializer(instance, context=context).data
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
+    image_renditions = ImageRenditionsField()
 
     class Meta:
         model = Recipe
-        fields = 'id', 'name', 'image', 'cooking_time'
+        fields = 'id', 'name', 'image', 'image_renditions', 'cooking_time'
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетного добавления и удаления."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_RECIPES_LIMIT
+    )
 
 
 class FavoriteSerializer(serializers.ModelSerializer):
@@ -229,7 +274,7 @@ class SetPasswordSerializer(serializers.ModelSerializer):
                 {'new_password': 'Новый пароль не должен совпадать с текущим.'}
             )
         instance.set_password(validated_data['new_password'])
-        instance.save()
+        instance.save(update_fields=['password'])
         return validated_data
 
     class Meta:
@@ -242,7 +287,7 @@ class SubscriptionsSerializer(UsersSerializer):
     """[GET] Сериализатор возвращает пользователей,
     на которых подписан текущий пользователь.
     В выдачу добавляются рецепты.(наследуется от UsersSerializer)"""
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
     recipes = serializers.SerializerMethodField()
 
     class Meta:
@@ -251,26 +296,20 @@ class SubscriptionsSerializer(UsersSerializer):
                   'is_subscribed', 'recipes', 'recipes_count')
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
-        serializer = RecipeSerializer(recipes, many=True, read_only=True)
+        # Рецепты уже ограничены recipes_limit в UsersViewSet.subscriptions
+        serializer = RecipeShortSerializer(obj.recipes.all(), many=True,
+                                           read_only=True,
+                                           context=self.context)
         return serializer.data
 
-    @staticmethod
-    def get_recipes_count(obj):
-        return obj.recipes.count()
-
 
 class SubscribeSerializer(serializers.ModelSerializer):
     """[POST, DELETE] Сериализатор для подписки и отписки(кастомный)."""
     email = serializers.ReadOnlyField()
     username = serializers.ReadOnlyField()
     is_subscribed = serializers.SerializerMethodField()
-    recipes = RecipeSerializer(many=True, read_only=True)
-    recipes_count = serializers.SerializerMethodField()
+    recipes = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
     first_name = serializers.CharField(required=False)
     last_name = serializers.CharField(required=False)
 
@@ -282,17 +321,11 @@ class SubscribeSerializer(serializers.ModelSerializer):
     def get_is_subscribed(self, obj):
         return check_subscribed(request=self.context.get('request'), obj=obj)
 
-    @staticmethod
-    def get_recipes_count(obj):
-        return obj.recipes.count()
-
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
-        serializer = RecipeShortSerializer(recipes, many=True, read_only=True)
+        # Рецепты уже ограничены recipes_limit в UsersViewSet.subscribe
+        serializer = RecipeShortSerializer(obj.recipes.all(), many=True,
+                                           read_only=True,
+                                           context=self.context)
         return serializer.data
 
 # SUBSCRIPTIONS #
@@ -0,0 +1,73 @@
+from django.contrib.auth import get_user_model
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from recipes.models import Ingredient, Recipe, RecipeIngredientAmount, Tag
+from recipes.renditions import renditions_generated
+from .documents import refresh_documents_on_commit, refresh_recipe_documents
+from .middleware import watch_connection
+
+User = get_user_model()
+
+
+@receiver(connection_created)
+def count_connection_queries(connection, **kwargs):
+    watch_connection(connection)
+
+
+def recipe_ids(**filters):
+    return lambda: list(Recipe.objects.filter(**filters).values_list(
+        'pk', flat=True))
+
+
+# Документ рецепта устаревает вместе с рецептом, его тегами, составом
+# и автором. Состав сохраняется bulk_create уже после рецепта, поэтому
+# документы собираются после коммита.
+@receiver(post_save, sender=Recipe)
+def refresh_recipe_document(instance, **kwargs):
+    refresh_documents_on_commit(lambda: [instance.pk])
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredientAmount)
+def refresh_amount_document(instance, **kwargs):
+    refresh_documents_on_commit(lambda: [instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def refresh_relations_document(instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        ids = list(pk_set or ()) if reverse else [instance.pk]
+        refresh_documents_on_commit(lambda: ids)
+
+
+@receiver(post_save, sender=Tag)
+def refresh_tag_documents(instance, **kwargs):
+    refresh_documents_on_commit(recipe_ids(tags=instance))
+
+
+@receiver(pre_delete, sender=Tag)
+def refresh_deleted_tag_documents(instance, **kwargs):
+    # Связи с тегом удаляются каскадом без m2m_changed
+    ids = recipe_ids(tags=instance)()
+    refresh_documents_on_commit(lambda: ids)
+
+
+@receiver(post_save, sender=Ingredient)
+def refresh_ingredient_documents(instance, **kwargs):
+    refresh_documents_on_commit(recipe_ids(ingredients=instance))
+
+
+@receiver(post_save, sender=User)
+def refresh_author_documents(instance, update_fields=None, **kwargs):
+    # Вход и смена пароля не меняют автора в выдаче рецептов
+    if update_fields is None or not set(update_fields) <= {'last_login',
+                                                           'password'}:
+        refresh_documents_on_commit(recipe_ids(author=instance))
+
+
+@receiver(renditions_generated)
+def refresh_image_documents(name, **kwargs):
+    refresh_recipe_documents(recipe_ids(image=name)())
@@ -0,0 +1,657 @@
+import io
+import tempfile
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APIRequestFactory
+
+from foodgram import routers
+from foodgram.routers import use_primary
+
+from recipes.cache import (RECIPES_NAMESPACE, TAGS_NAMESPACE, bump_version,
+                           get_version, user_namespace)
+from recipes.counters import (REBASE_EXPONENT, count_marks, get_epoch,
+                              rebuild_trending_scores)
+from recipes.models import (Favorite, Ingredient, Recipe,
+                            RecipeIngredientAmount, ShoppingCart, Tag)
+from recipes.renditions import generate, rendition_name
+from recipes.search import refresh_search_documents
+from users.models import Subscription, User
+from .documents import refresh_recipe_documents
+from .metrics import QueryBudgetError
+from .offload import StreamingASGIHandler
+from .serializers import RecipeSerializer
+
+RECIPES_COUNT = 50
+
+
+class RecipesTestCase(TestCase):
+    """Три автора, RECIPES_COUNT рецептов с тегами и составом; первый
+    автор — self.user — отмечает часть рецептов в избранном и корзине
+    и подписан на второго."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{number}', email=f'author{number}@x.ru',
+                password='password', first_name='Имя', last_name='Фамилия')
+            for number in range(3)]
+        cls.user = cls.authors[0]
+        cls.tags = [Tag.objects.create(name=f'Тег {number}',
+                                       color=f'#00000{number}',
+                                       slug=f'tag{number}')
+                    for number in range(3)]
+        ingredients = [Ingredient.objects.create(name=f'Ингредиент {number}',
+                                                 measurement_unit='г')
+                       for number in range(4)]
+        for number in range(RECIPES_COUNT):
+            recipe = Recipe.objects.create(
+                author=cls.authors[number % len(cls.authors)],
+                name=f'Рецепт {number}', text='Описание',
+                cooking_time=number + 1)
+            recipe.tags.set(cls.tags[:number % len(cls.tags) + 1])
+            RecipeIngredientAmount.objects.bulk_create(
+                RecipeIngredientAmount(recipe=recipe, ingredient=ingredient,
+                                       amount=10)
+                for ingredient in ingredients[:number % len(ingredients) + 1])
+            if number % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if number % 3:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        Subscription.objects.create(user=cls.user, author=cls.authors[1])
+        # Документы собираются после коммита, а TestCase его не делает
+        refresh_recipe_documents(
+            Recipe.objects.values_list('pk', flat=True))
+
+    def setUp(self):
+        # Если настроены реплики, транзакция теста видна только основной
+        # базе
+        primary = use_primary()
+        primary.__enter__()
+        self.addCleanup(primary.__exit__, None, None, None)
+        self.anonymous = APIClient()
+        self.authorized = APIClient()
+        self.authorized.force_authenticate(self.user)
+
+
+@override_settings(RECIPE_PAGE_CACHE_TIMEOUT=0)
+class RecipeListQueriesTest(RecipesTestCase):
+    """Число SQL-запросов ленты рецептов не зависит от размера страницы:
+    флаги пользователя, теги, состав и автор не читаются по рецепту."""
+
+    def assert_list_queries(self, client, queries):
+        for limit in (1, RECIPES_COUNT):
+            with self.subTest(limit=limit):
+                cache.clear()
+                with self.assertNumQueries(queries):
+                    response = client.get('/api/recipes/', {'limit': limit})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_anonymous(self):
+        self.assert_list_queries(self.anonymous, 3)
+
+    def test_authorized(self):
+        self.assert_list_queries(self.authorized, 3)
+
+    @override_settings(RECIPE_DOCUMENTS_ENABLED=False)
+    def test_anonymous_without_documents(self):
+        self.assert_list_queries(self.anonymous, 5)
+
+    @override_settings(RECIPE_DOCUMENTS_ENABLED=False)
+    def test_authorized_without_documents(self):
+        self.assert_list_queries(self.authorized, 5)
+
+    def test_authorized_flags(self):
+        response = self.authorized.get('/api/recipes/',
+                                       {'limit': RECIPES_COUNT})
+        recipes = {recipe['id']: recipe for recipe in response.data['results']}
+        favorited = set(Favorite.objects.filter(
+            user=self.user).values_list('recipe_id', flat=True))
+        in_cart = set(ShoppingCart.objects.filter(
+            user=self.user).values_list('recipe_id', flat=True))
+        for pk, recipe in recipes.items():
+            self.assertEqual(recipe['is_favorited'], pk in favorited)
+            self.assertEqual(recipe['is_in_shopping_cart'], pk in in_cart)
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'tests'}})
+class CacheTest(RecipesTestCase):
+    """Ответы справочников и страницы ленты читаются из кеша, пока
+    сигналы не повысят версию их данных."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_versions(self):
+        version = get_version(TAGS_NAMESPACE)
+        self.assertEqual(get_version(TAGS_NAMESPACE), version)
+        self.assertEqual(bump_version(TAGS_NAMESPACE), version + 1)
+        self.assertEqual(get_version(TAGS_NAMESPACE), version + 1)
+        # Версия после очистки кеша начинается с текущего времени
+        cache.clear()
+        with mock.patch('recipes.cache.time.time', return_value=1000):
+            self.assertEqual(get_version(TAGS_NAMESPACE), 1000 * 1000)
+
+    def test_reference_hit(self):
+        response = self.anonymous.get('/api/tags/')
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            cached = self.anonymous.get('/api/tags/')
+        self.assertEqual(cached.data, response.data)
+        self.assertEqual(cached['ETag'], etag)
+        with self.assertNumQueries(0):
+            response = self.anonymous.get('/api/tags/',
+                                          HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_reference_invalidation(self):
+        etag = self.anonymous.get('/api/tags/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Новый', color='#FFFFFF', slug='new')
+        response = self.anonymous.get('/api/tags/',
+                                      HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('new', [tag['slug'] for tag in response.data])
+
+    @override_settings(RECIPE_PAGE_CACHE_TIMEOUT=60)
+    def test_recipe_page_hit(self):
+        response = self.anonymous.get('/api/recipes/')
+        with self.assertNumQueries(0):
+            cached = self.anonymous.get('/api/recipes/')
+        self.assertEqual(cached.data, response.data)
+        # Общая страница для пользователя: из кеша, флаги одним запросом
+        with self.assertNumQueries(1):
+            self.authorized.get('/api/recipes/')
+
+    @override_settings(RECIPE_PAGE_CACHE_TIMEOUT=60)
+    def test_recipe_page_invalidation(self):
+        recipe = self.anonymous.get('/api/recipes/').data['results'][0]
+        version = get_version(RECIPES_NAMESPACE)
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.get(pk=recipe['id']).tags.clear()
+        self.assertGreater(get_version(RECIPES_NAMESPACE), version)
+        response = self.anonymous.get('/api/recipes/')
+        self.assertEqual(response.data['results'][0]['tags'], [])
+
+    @override_settings(RECIPE_PAGE_CACHE_TIMEOUT=60)
+    def test_personal_page_invalidation(self):
+        params = {'is_favorited': 1, 'limit': RECIPES_COUNT}
+        count = self.authorized.get('/api/recipes/', params).data['count']
+        version = get_version(user_namespace(self.user.pk))
+        recipe = Recipe.objects.exclude(in_favorites__user=self.user).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.user, recipe=recipe)
+        self.assertGreater(get_version(user_namespace(self.user.pk)),
+                           version)
+        response = self.authorized.get('/api/recipes/', params)
+        self.assertEqual(response.data['count'], count + 1)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'FTS5 есть только в SQLite')
+@override_settings(RECIPE_PAGE_CACHE_TIMEOUT=0)
+class SearchTest(RecipesTestCase):
+    """Поиск в SQLite через FTS5: слова ищутся как префиксы и все сразу,
+    совпадение в названии важнее состава, состав важнее описания."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        saffron = Ingredient.objects.create(name='Шафран',
+                                            measurement_unit='г')
+        cls.in_text = Recipe.objects.create(
+            author=cls.user, name='Рис', text='Можно добавить шафрана',
+            cooking_time=10)
+        cls.in_ingredients = Recipe.objects.create(
+            author=cls.user, name='Плов', text='Описание', cooking_time=10)
+        RecipeIngredientAmount.objects.create(
+            recipe=cls.in_ingredients, ingredient=saffron, amount=1)
+        cls.in_name = Recipe.objects.create(
+            author=cls.user, name='Шафрановый рис', text='Описание',
+            cooking_time=10)
+        recipe_ids = Recipe.objects.values_list('pk', flat=True)
+        refresh_search_documents(recipe_ids)
+        refresh_recipe_documents(recipe_ids)
+
+    def search(self, query):
+        response = self.anonymous.get('/api/recipes/', {
+            'search': query, 'limit': RECIPES_COUNT})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_ranking(self):
+        self.assertEqual(
+            self.search('шафран'),
+            [self.in_name.pk, self.in_ingredients.pk, self.in_text.pk])
+
+    def test_all_words(self):
+        self.assertEqual(self.search('рис шафран'),
+                         [self.in_name.pk, self.in_text.pk])
+
+    def test_no_words(self):
+        self.assertEqual(self.search('"*'), [])
+
+    def test_updated_document(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.in_text.text = 'Описание'
+            self.in_text.save()
+        self.assertEqual(self.search('шафран'),
+                         [self.in_name.pk, self.in_ingredients.pk])
+
+
+class QueryBudgetTest(RecipesTestCase):
+    """Превышение QUERY_BUDGETS пишется в лог, а с QUERY_BUDGET_RAISE
+    роняет запрос."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    @override_settings(QUERY_BUDGETS={'tags.list': 0},
+                       QUERY_BUDGET_RAISE=True)
+    def test_raise(self):
+        with self.assertRaisesMessage(QueryBudgetError, 'tags.list'):
+            self.anonymous.get('/api/tags/')
+
+    @override_settings(QUERY_BUDGETS={'tags.list': 0})
+    def test_warning(self):
+        with self.assertLogs('api.metrics', 'WARNING'):
+            response = self.anonymous.get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(QUERY_BUDGETS={'tags.list': 1},
+                       QUERY_BUDGET_RAISE=True)
+    def test_within_budget(self):
+        self.assertEqual(self.anonymous.get('/api/tags/').status_code, 200)
+
+
+class StreamingASGIHandlerTest(TransactionTestCase):
+    """Под ASGI список покупок уходит частями по мере чтения из базы.
+    Части читаются в общем синхронном потоке, поэтому данные должны
+    быть закоммичены."""
+    # С репликами GET-запрос читает с реплики — зеркала основной базы
+    databases = {'default', 'replica1'}.intersection(settings.DATABASES)
+
+    def setUp(self):
+        user = User.objects.create_user(
+            username='user', email='user@x.ru', password='password')
+        self.token = Token.objects.create(user=user)
+        recipe = Recipe.objects.create(author=user, name='Рецепт',
+                                       text='Описание', cooking_time=1)
+        RecipeIngredientAmount.objects.bulk_create(
+            RecipeIngredientAmount(
+                recipe=recipe, amount=number + 1,
+                ingredient=Ingredient.objects.create(
+                    name=f'Ингредиент {number}', measurement_unit='г'))
+            for number in range(5))
+        ShoppingCart.objects.create(user=user, recipe=recipe)
+
+    async def request(self, path):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        await StreamingASGIHandler()({
+            'type': 'http', 'method': 'GET', 'path': path,
+            'query_string': b'', 'headers': [
+                (b'authorization', f'Token {self.token}'.encode())],
+        }, receive, send)
+        return messages
+
+    def test_download_streams(self):
+        path = '/api/recipes/download_shopping_cart/'
+        start, *body = async_to_sync(self.request)(path)
+        self.assertEqual(start['status'], 200)
+        # По части на строку и пустое закрывающее сообщение
+        self.assertGreater(len(body), 2)
+        self.assertFalse(body[-1].get('more_body', False))
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.assertEqual(
+            b''.join(message.get('body', b'') for message in body),
+            b''.join(client.get(path).streaming_content))
+
+
+class RenditionsTest(RecipesTestCase):
+    """Версии картинок сохраняют прозрачность, а ссылки на них строятся
+    по отметкам в рецепте, без обращений к хранилищу."""
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def save_image(self, mode):
+        buffer = io.BytesIO()
+        Image.new(mode, (1000, 500)).save(buffer, 'PNG')
+        return default_storage.save(f'recipes/images/{mode}.png',
+                                    ContentFile(buffer.getvalue()))
+
+    def test_transparency(self):
+        for mode, expected in (('RGBA', 'RGBA'), ('RGB', 'RGB')):
+            with self.subTest(mode=mode):
+                name = self.save_image(mode)
+                generate(name)
+                with default_storage.open(
+                        rendition_name(name, 'thumbnail')) as file:
+                    self.assertEqual(Image.open(file).mode, expected)
+
+    def test_urls_from_model(self):
+        recipes = Recipe.objects.all()[:2]
+        name = self.save_image('RGB')
+        Recipe.objects.filter(pk__in=[recipe.pk for recipe in recipes]
+                              ).update(image=name)
+        request = APIRequestFactory().get('/')
+        request.user = self.user
+        with mock.patch.object(default_storage, 'exists') as exists:
+            data = RecipeSerializer(Recipe.objects.get(pk=recipes[0].pk),
+                                    context={'request': request}).data
+        exists.assert_not_called()
+        self.assertEqual(set(data['image_renditions'].values()), {None})
+        generate(name)
+        for recipe in recipes:
+            data = RecipeSerializer(Recipe.objects.get(pk=recipe.pk),
+                                    context={'request': request}).data
+            self.assertTrue(all(data['image_renditions'].values()))
+            self.assertTrue(data['image_renditions']['feed'].endswith(
+                rendition_name(name, 'feed')))
+
+
+@override_settings(RECIPE_PAGE_CACHE_TIMEOUT=0)
+class CursorPaginationTest(RecipesTestCase):
+    """Курсор — ключ (pub_date, id) крайней строки: страницы не теряют
+    и не повторяют рецепты с одинаковой датой публикации."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Половина рецептов опубликована в одну и ту же секунду
+        pub_date = Recipe.objects.order_by('pub_date').first().pub_date
+        Recipe.objects.filter(
+            pk__in=Recipe.objects.order_by('pk').values('pk')[
+                :RECIPES_COUNT // 2]
+        ).update(pub_date=pub_date)
+
+    def walk(self, url, direction):
+        pages = []
+        while url:
+            response = self.anonymous.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([recipe['id'] for recipe in
+                          response.data['results']])
+            url = response.data[direction]
+        return pages
+
+    def test_forward_and_back(self):
+        expected = list(Recipe.objects.order_by(
+            '-pub_date', '-id').values_list('pk', flat=True))
+        pages = self.walk('/api/recipes/?cursor=&limit=7', 'next')
+        self.assertEqual(sum(pages, []), expected)
+        self.assertTrue(all(len(page) == 7 for page in pages[:-1]))
+        last = self.anonymous.get('/api/recipes/?cursor=&limit=7')
+        for _ in pages[1:]:
+            last = self.anonymous.get(last.data['next'])
+        back = self.walk(last.data['previous'], 'previous')
+        self.assertEqual(back[::-1], pages[:-1])
+
+    @override_settings(RECIPE_DOCUMENTS_ENABLED=False)
+    def test_without_documents(self):
+        pages = self.walk('/api/recipes/?cursor=&limit=20', 'next')
+        self.assertEqual(len(sum(pages, [])), RECIPES_COUNT)
+
+    def test_subscriptions(self):
+        response = self.authorized.get('/api/users/subscriptions/',
+                                       {'cursor': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([author['id'] for author in response.data[
+            'results']], [self.authors[1].pk])
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_cursor(self):
+        response = self.anonymous.get('/api/recipes/', {'cursor': 'xyz'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_search(self):
+        response = self.anonymous.get('/api/recipes/', {
+            'cursor': '', 'search': 'Рецепт'})
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkMarksTest(RecipesTestCase):
+    """Пакетное добавление и удаление отметок обновляет счётчики одним
+    запросом на пачку и меняет версии ленты и пользователя один раз."""
+
+    def bulk(self, method, path, ids):
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(self.authorized, method)(
+                    path, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def favorited(self):
+        return list(Favorite.objects.filter(user=self.user).order_by(
+            'recipe_id').values_list('recipe_id', flat=True))
+
+    def test_delete_queries(self):
+        favorited = self.favorited()
+        _, few = self.bulk('delete', '/api/recipes/favorite/',
+                           favorited[:2])
+        _, many = self.bulk('delete', '/api/recipes/favorite/',
+                            favorited[2:12])
+        self.assertEqual(few, many)
+
+    def shopping_list(self):
+        return set(self.user.shopping_list.exclude(total_amount=0).values_list(
+            'ingredient_id', 'total_amount'))
+
+    def test_counters_and_versions(self):
+        shopping_list = self.shopping_list()
+        for path, model, field in (
+                ('/api/recipes/favorite/', Favorite, 'favorites_count'),
+                ('/api/recipes/shopping_cart/', ShoppingCart, 'carts_count')):
+            with self.subTest(model=model.__name__):
+                recipes = Recipe.objects.exclude(pk__in=model.objects.filter(
+                    user=self.user).values('recipe_id'))[:5]
+                before = {recipe.pk: (getattr(recipe, field),
+                                      recipe.trending_score)
+                          for recipe in recipes}
+                recipes_version = get_version(RECIPES_NAMESPACE)
+                user_version = get_version(user_namespace(self.user.pk))
+                response, _ = self.bulk('post', path, list(before))
+                self.assertEqual(
+                    {item['status'] for item in response.data['results']},
+                    {'added'})
+                self.assertEqual(get_version(RECIPES_NAMESPACE),
+                                 recipes_version + 1)
+                self.assertEqual(get_version(user_namespace(self.user.pk)),
+                                 user_version + 1)
+                for pk, count, score in Recipe.objects.filter(
+                        pk__in=before).values_list('pk', field,
+                                                   'trending_score'):
+                    self.assertEqual(count, before[pk][0] + 1)
+                    self.assertGreater(score, before[pk][1])
+                self.bulk('delete', path, list(before))
+                self.assertEqual(get_version(RECIPES_NAMESPACE),
+                                 recipes_version + 2)
+                for pk, count, score in Recipe.objects.filter(
+                        pk__in=before).values_list('pk', field,
+                                                   'trending_score'):
+                    self.assertEqual(count, before[pk][0])
+                    self.assertAlmostEqual(score, before[pk][1],
+                                           delta=before[pk][1] * 1e-9)
+        self.assertEqual(self.shopping_list(), shopping_list)
+
+
+class RecipeUserFlagsTest(RecipesTestCase):
+    """Флаги избранного и корзины верны и у рецептов без аннотаций
+    with_user_flags."""
+
+    def test_serializer_without_annotations(self):
+        request = APIRequestFactory().get('/')
+        request.user = self.user
+        for recipe in Recipe.objects.all():
+            data = RecipeSerializer(recipe, context={'request': request}).data
+            self.assertEqual(data['is_favorited'], Favorite.objects.filter(
+                user=self.user, recipe=recipe).exists())
+            self.assertEqual(
+                data['is_in_shopping_cart'], ShoppingCart.objects.filter(
+                    user=self.user, recipe=recipe).exists())
+
+    def test_subscribe_recipes(self):
+        author = self.authors[2]
+        response = self.authorized.post(
+            f'/api/users/{author.pk}/subscribe/?recipes_limit=2')
+        self.assertEqual(response.status_code, 201)
+        recipes = response.data['recipes']
+        self.assertEqual(
+            [recipe['id'] for recipe in recipes],
+            list(author.recipes.order_by('-pub_date', '-pk').values_list(
+                'pk', flat=True)[:2]))
+        # Короткое представление, как в выдаче подписок: без флагов
+        # пользователя, которые нечем было бы заполнить
+        for recipe in recipes:
+            self.assertEqual(
+                set(recipe),
+                {'id', 'name', 'image', 'image_renditions', 'cooking_time'})
+
+
+class TrendingRebaseTest(RecipesTestCase):
+    """Эпоха trending сдвигается сама, не меняя порядка рецептов."""
+
+    def trending(self):
+        return list(Recipe.objects.filter(trending_score__gt=0).order_by(
+            '-trending_score', '-pub_date', '-pk').values_list(
+                'pk', flat=True))
+
+    def test_rebase_on_new_mark(self):
+        rebuild_trending_scores()
+        order = self.trending()
+        epoch = get_epoch()
+        half_life = timedelta(hours=settings.TRENDING_HALF_LIFE_HOURS)
+        # Отметка так далеко от эпохи, что без сдвига вклад был бы
+        # больше допустимого
+        added_date = epoch + half_life * (REBASE_EXPONENT + 600)
+        count_marks(Favorite, {order[-1]: added_date}, 1)
+        new_epoch = get_epoch()
+        self.assertGreater(new_epoch, epoch)
+        self.assertEqual((new_epoch - epoch) % half_life, timedelta(0))
+        # Старые вклады затухли, новый вышел вперёд
+        self.assertEqual(self.trending()[0], order[-1])
+        self.assertEqual(Recipe.objects.get(pk=order[-1]).trending_score,
+                         1.0)
+
+
+@skipUnless('replica1' in settings.DATABASES,
+            'нужна реплика: DB_REPLICA_HOSTS и общий CACHE_BACKEND')
+class ReplicaRoutingTest(TransactionTestCase):
+    """Чтение безопасных запросов идёт на реплику, чтение после записи и
+    при недоступной реплике — с основной базы.
+
+    В тестах реплика — зеркало основной базы через своё соединение,
+    поэтому проверяется, через какое соединение идут запросы. Транзакция
+    TestCase была бы этому соединению не видна."""
+    # Раннер собирает базы и у пропущенных тестов
+    databases = {'default', 'replica1'}.intersection(settings.DATABASES)
+
+    def setUp(self):
+        routers._down.clear()
+        self.addCleanup(routers._down.clear)
+        self.user = User.objects.create_user(
+            username='user', email='user@x.ru', password='password')
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Рецепт', text='Описание',
+            cooking_time=1)
+        self.anonymous = APIClient()
+        self.authorized = APIClient()
+        self.authorized.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user)}')
+        # Создание рецепта закрепило ленту за основной базой
+        cache.clear()
+
+    def assert_reads_from(self, alias, request):
+        other = 'replica1' if alias == 'default' else 'default'
+        with CaptureQueriesContext(connections[alias]) as used:
+            with CaptureQueriesContext(connections[other]) as unused:
+                response = request()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(used.captured_queries)
+        # Токены всегда читаются с основной базы
+        self.assertFalse([query for query in unused.captured_queries
+                          if 'authtoken' not in query['sql']])
+
+    def test_reads_from_replica(self):
+        self.assert_reads_from(
+            'replica1', lambda: self.anonymous.get('/api/recipes/'))
+
+    def test_read_your_writes(self):
+        response = self.authorized.post(
+            f'/api/recipes/{self.recipe.pk}/favorite/')
+        self.assertEqual(response.status_code, 201)
+        self.assert_reads_from(
+            'default', lambda: self.authorized.get('/api/recipes/', {
+                'is_favorited': 1}))
+        # Другие клиенты по-прежнему читают с реплики
+        self.assert_reads_from(
+            'replica1', lambda: self.anonymous.get('/api/recipes/'))
+
+    def get_without_replica(self, path):
+        with mock.patch.object(connections['replica1'], 'ensure_connection',
+                               side_effect=OperationalError):
+            return self.anonymous.get(path)
+
+    def test_unavailable_replica(self):
+        self.assert_reads_from(
+            'default', lambda: self.get_without_replica('/api/recipes/'))
+        # Реплика пропускается до DB_REPLICA_RETRY_SECONDS
+        cache.clear()
+        self.assert_reads_from(
+            'default', lambda: self.anonymous.get('/api/recipes/'))
+        routers._down.clear()
+        cache.clear()
+        self.assert_reads_from(
+            'replica1', lambda: self.anonymous.get('/api/recipes/'))
+
+    def test_readiness_degraded(self):
+        response = self.get_without_replica('/api/ready/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['ready'])
+        self.assertTrue(response.data['degraded'])
+
+
+class ReplicaCacheTest(TestCase):
+    """Закрепления за основной базой хранятся в кеше: с кешем в памяти
+    процесса другие воркеры их бы не видели."""
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_local_cache(self):
+        with mock.patch.object(routers, 'get_replicas',
+                               return_value=['replica1']):
+            with self.assertRaises(ImproperlyConfigured):
+                routers.PrimaryReplicaRouter()
+        # Без реплик кеш в памяти допустим
+        with mock.patch.object(routers, 'get_replicas', return_value=[]):
+            routers.PrimaryReplicaRouter()
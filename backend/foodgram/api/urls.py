@@ -1,7 +1,10 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet, UsersViewSet
+from .offload import offload_reads
+from .views import (IngredientViewSet, MetricsView, ReadinessView,
+                    RecipeViewSet, TagViewSet, UsersViewSet)
 
 app_name = 'api'
 
@@ -12,7 +15,21 @@ router.register('tags', TagViewSet, basename='tags')
 router.register('users', UsersViewSet, basename='users')
 router.register('recipes', RecipeViewSet, basename='recipes')
 
+# Под ASGI эти маршруты читают базу в пуле потоков, не занимая общий
+# синхронный поток
+ASYNC_READ_ROUTES = (
+    'recipes-list', 'recipes-detail', 'recipes-download-shopping-cart',
+    'tags-list', 'tags-detail', 'ingredients-list', 'ingredients-detail',
+)
+
+if settings.SERVER_MODE == 'asgi':
+    for pattern in router.urls:
+        if pattern.name in ASYNC_READ_ROUTES:
+            pattern.callback = offload_reads(pattern.callback)
+
 urlpatterns = (
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('ready/', ReadinessView.as_view(), name='ready'),
 )
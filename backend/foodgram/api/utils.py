@@ -1,8 +1,19 @@
+import time
+from calendar import timegm
+
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Count, Max
 from django.shortcuts import get_object_or_404
+from django.utils.http import quote_etag
 from rest_framework import status
 from rest_framework.response import Response
 
-from recipes.models import Recipe
+from recipes.cache import (INGREDIENTS_NAMESPACE, RECIPES_NAMESPACE,
+                           bump_on_commit, get_version, user_namespace)
+from recipes.counters import count_marks
+from recipes.models import Recipe, ShoppingCart, ShoppingListItem
+from recipes.shopping_list import change_cart
+from recipes.signals import handle_marks_in_bulk
 from users.models import Subscription
 
 
@@ -27,8 +38,122 @@ def recipe_add_or_del_method(request, model, pk, custom_serializer):
                     status=status.HTTP_204_NO_CONTENT)
 
 
+def recipe_bulk_add_or_del_method(request, model, ids):
+    """Добавляет или удаляет несколько рецептов в одной транзакции и
+    возвращает статус каждого id: added, exists, removed, absent или
+    not_found.
+
+    Счётчики и рейтинг рецептов, поколения пользователя и ленты и список
+    покупок обновляются здесь один раз на всю пачку: bulk_create
+    сигналов не отправляет, а обработчики сигналов удаления отключены
+    через handle_marks_in_bulk."""
+    ids = list(dict.fromkeys(ids))
+    user = request.user
+    with transaction.atomic(), handle_marks_in_bulk():
+        found = set(Recipe.objects.filter(pk__in=ids).values_list(
+            'pk', flat=True))
+        present = set(model.objects.filter(
+            user=user, recipe_id__in=found).values_list('recipe_id',
+                                                        flat=True))
+        if request.method == 'POST':
+            dates = {obj.recipe_id: obj.added_date
+                     for obj in model.objects.bulk_create(
+                         [model(user=user, recipe_id=pk)
+                          for pk in ids if pk in found and pk not in present],
+                         ignore_conflicts=True)}
+            # Параллельный запрос мог успеть добавить те же рецепты:
+            # учитываются только строки с датой, выставленной здесь
+            marks = {pk: date for pk, date in model.objects.filter(
+                user=user, recipe_id__in=dates
+            ).values_list('recipe_id', 'added_date') if date == dates[pk]}
+            apply_marks(model, user.pk, marks, 1)
+            statuses = {pk: 'exists' for pk in found - set(marks)}
+            statuses.update({pk: 'added' for pk in marks})
+        else:
+            # Строки блокируются, чтобы параллельное удаление не учло
+            # их второй раз
+            marks = dict(model.objects.select_for_update().filter(
+                user=user, recipe_id__in=present).values_list(
+                'recipe_id', 'added_date'))
+            model.objects.filter(user=user, recipe_id__in=marks).delete()
+            apply_marks(model, user.pk, marks, -1)
+            statuses = {pk: 'removed' for pk in marks}
+            statuses.update({pk: 'absent' for pk in found - set(marks)})
+    return Response({'results': [
+        {'id': pk, 'status': statuses.get(pk, 'not_found')} for pk in ids
+    ]})
+
+
+def apply_marks(model, user_id, marks, delta):
+    """Последствия добавления (delta=1) или удаления (delta=-1) отметок
+    marks = {recipe_id: added_date}: один UPDATE счётчиков и рейтинга,
+    по одной смене версии ленты и поколения пользователя."""
+    if not marks:
+        return
+    count_marks(model, marks, delta)
+    bump_on_commit(user_namespace(user_id))
+    # Число добавлений и рейтинг задают порядок popular и trending
+    bump_on_commit(RECIPES_NAMESPACE)
+    if model is ShoppingCart:
+        change_cart(user_id, marks, delta)
+
+
+def parse_ids(values):
+    """id из повторяющегося параметра или списка через запятую;
+    None, если хотя бы одно значение не число."""
+    ids = [value.strip() for item in values for value in item.split(',')]
+    ids = [value for value in ids if value]
+    if not all(value.isdigit() for value in ids):
+        return None
+    return [int(value) for value in ids]
+
+
 def check_subscribed(request, obj):
-    if request and not request.user.is_anonymous:
-        return Subscription.objects.filter(
-            user=request.user, author=obj).exists()
-    return False
+    if not request or request.user.is_anonymous:
+        return False
+    # Флаг, посчитанный в UserQuerySet.with_is_subscribed
+    if hasattr(obj, 'is_subscribed'):
+        return obj.is_subscribed
+    return Subscription.objects.filter(
+        user=request.user, author=obj).exists()
+
+
+def get_shopping_cart_validators(user, suffix):
+    """ETag и Last-Modified списка покупок по последнему изменению его
+    строк: их меняют и корзина, и правка состава рецептов из неё.
+
+    Число строк входит в ETag, чтобы удаление строки, не меняющее дату
+    последнего изменения остальных, тоже давало новый документ, версия
+    ингредиентов — чтобы учесть их переименование."""
+    items = ShoppingListItem.objects.filter(user=user).aggregate(
+        modified=Max('modified'), rows=Count('id'))
+    last_modified = marker = None
+    if items['modified'] is not None:
+        last_modified = timegm(items['modified'].utctimetuple())
+        marker = items['modified'].timestamp()
+    etag = quote_etag(
+        f'{user.id}-{items["rows"]}-{marker}-'
+        f'{get_version(INGREDIENTS_NAMESPACE)}-{suffix}')
+    return etag, last_modified
+
+
+def database_status(alias):
+    """Проверяет соединение с базой alias и отдаёт загрузку её пула
+    в текущем процессе."""
+    connection = connections[alias]
+    started = time.perf_counter()
+    try:
+        connection.ensure_connection()
+        ready = connection.is_usable()
+    except DatabaseError:
+        ready = False
+    if not ready:
+        connection.close()
+    result = {
+        'ready': ready,
+        'latency_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+    pool = getattr(connection, 'pool', None)
+    if pool is not None:
+        result['pool'] = pool.stats()
+    return result
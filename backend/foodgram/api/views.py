@@ -1,39 +1,74 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import BooleanField, Prefetch, Value
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from recipes.models import (Favorite, Ingredient, Recipe,
-                            RecipeIngredientAmount, ShoppingCart, Tag)
+from recipes.autocomplete import ingredient_index
+from recipes.cache import INGREDIENTS_NAMESPACE, TAGS_NAMESPACE
+from recipes.matching import recipe_match_index
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, SimilarRecipe, Tag)
+from recipes.units import normalize_rows
 from users.models import Subscription, User
+from .documents import PAGE_FIELDS, RecipeDocumentSerializer
+from .exporters import EXPORTERS
 from .filters import IngredientFilter, RecipesFilter
-from .pagination import CustomUsersPagination
+from .metrics import render_prometheus
+from .mixins import CachedRecipePagesMixin, CachedResponseMixin
+from .pagination import (CustomRecipesPagination, CustomUsersPagination,
+                         SubscriptionsPagination)
 from .permissions import IsAdminOrAuthorOrReadOnly
+from .renderers import PrometheusRenderer
 from .serializers import (IngredientSerializer, RecipeCreateSerializer,
-                          RecipeSerializer, RecipeShortSerializer,
-                          SetPasswordSerializer, SubscribeSerializer,
+                          RecipeIdsSerializer, RecipeSerializer,
+                          RecipeShortSerializer, SetPasswordSerializer,
+                          ShoppingListItemSerializer, SubscribeSerializer,
                           SubscriptionsSerializer, TagSerializer,
                           UsersSerializer)
-from .utils import recipe_add_or_del_method
+from .utils import (database_status, get_shopping_cart_validators, parse_ids,
+                    recipe_add_or_del_method, recipe_bulk_add_or_del_method)
 
+EXPORT_CHUNK_SIZE = 2000
 
-class IngredientViewSet(viewsets.ModelViewSet):
+
+class IngredientViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = (IngredientFilter,)
     search_fields = ('^name',)
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    cache_namespace = INGREDIENTS_NAMESPACE
+
+    def list(self, request, *args, **kwargs):
+        if not settings.INGREDIENT_INDEX_ENABLED:
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(request,
+                                    lambda: self.search_index(request))
 
+    @staticmethod
+    def search_index(request):
+        search = IngredientFilter()
+        terms = search.get_search_terms(request)
+        if not terms:
+            return ingredient_index.all()
+        return ingredient_index.search(terms[0], search.get_limit(request))
 
-class TagViewSet(viewsets.ModelViewSet):
+
+class TagViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    cache_namespace = TAGS_NAMESPACE
 
 
 class UsersViewSet(UserViewSet):
@@ -42,10 +77,30 @@ class UsersViewSet(UserViewSet):
     pagination_class = CustomUsersPagination
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
+    def get_queryset(self):
+        return super().get_queryset().with_is_subscribed(self.request.user)
+
+    @staticmethod
+    def get_recipes_prefetch(request):
+        """Рецепты авторов в выдаче подписок: не больше recipes_limit
+        последних у каждого автора одним запросом на всех авторов."""
+        recipes = Recipe.objects.all()
+        limit = request.query_params.get('recipes_limit')
+        if limit and limit.isdigit():
+            recipes = recipes.latest_per_author(int(limit))
+        return Prefetch('recipes', queryset=recipes)
+
     @action(detail=False, methods=['get'],
-            permission_classes=(permissions.IsAuthenticated,))
+            permission_classes=(permissions.IsAuthenticated,),
+            pagination_class=SubscriptionsPagination)
     def subscriptions(self, request):
-        queryset = User.objects.filter(subscriber__user=self.request.user)
+        queryset = User.objects.filter(
+            subscriber__user=self.request.user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).prefetch_related(
+            self.get_recipes_prefetch(request)
+        ).order_by('username')
         pages = self.paginate_queryset(queryset)
         serializer = SubscriptionsSerializer(pages, many=True,
                                              context={'request': request})
@@ -54,7 +109,9 @@ class UsersViewSet(UserViewSet):
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=(permissions.IsAuthenticated,))
     def subscribe(self, request, **kwargs):
-        author = get_object_or_404(User, id=kwargs['id'])
+        author = get_object_or_404(
+            User.objects.prefetch_related(self.get_recipes_prefetch(request)),
+            id=kwargs['id'])
 
         if request.method == 'POST':
             if self.request.user == author:
@@ -70,6 +127,15 @@ class UsersViewSet(UserViewSet):
         return Response({'detail': 'Успешная отписка'},
                         status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=['get'], url_path='me/shopping_list',
+            permission_classes=(permissions.IsAuthenticated,))
+    def shopping_list(self, request):
+        """Список покупок текущего пользователя из готовых строк."""
+        items = ShoppingListItem.objects.filter(
+            user=request.user).select_related('ingredient').order_by(
+            'ingredient__name')
+        return Response(ShoppingListItemSerializer(items, many=True).data)
+
     @action(detail=False, methods=['post'],
             permission_classes=(permissions.IsAuthenticated,))
     def set_password(self, request):
@@ -80,17 +146,27 @@ class UsersViewSet(UserViewSet):
                         status=status.HTTP_204_NO_CONTENT)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(CachedRecipePagesMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     permission_classes = (IsAdminOrAuthorOrReadOnly,)
-    pagination_class = CustomUsersPagination
+    pagination_class = CustomRecipesPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipesFilter
 
+    def get_queryset(self):
+        if self.request.method not in SAFE_METHODS:
+            return Recipe.objects.all()
+        if settings.RECIPE_DOCUMENTS_ENABLED:
+            return Recipe.objects.with_document_flags(
+                self.flags_user).only(*PAGE_FIELDS)
+        return Recipe.objects.optimized_for(self.flags_user)
+
     def get_serializer_class(self):
-        if self.request.method in SAFE_METHODS:
-            return RecipeSerializer
-        return RecipeCreateSerializer
+        if self.request.method not in SAFE_METHODS:
+            return RecipeCreateSerializer
+        if settings.RECIPE_DOCUMENTS_ENABLED:
+            return RecipeDocumentSerializer
+        return RecipeSerializer
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -114,18 +190,120 @@ class RecipeViewSet(viewsets.ModelViewSet):
                                         custom_serializer=RecipeShortSerializer
                                         )
 
-    @action(detail=False, methods=['get'])
+    def bulk_marks(self, request, model):
+        """Тело {"ids": [...]}; для DELETE id можно передать и в ?ids=."""
+        data = request.data
+        if request.method == 'DELETE' and 'ids' not in data:
+            data = {'ids': parse_ids(request.query_params.getlist('ids'))}
+        serializer = RecipeIdsSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        return recipe_bulk_add_or_del_method(
+            request, model, serializer.validated_data['ids'])
+
+    @action(detail=False, methods=['post', 'delete'], url_path='favorite',
+            url_name='favorite-bulk',
+            permission_classes=(permissions.IsAuthenticated,))
+    def favorite_bulk(self, request):
+        return self.bulk_marks(request, Favorite)
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='shopping_cart', url_name='shopping-cart-bulk',
+            permission_classes=(permissions.IsAuthenticated,))
+    def shopping_cart_bulk(self, request):
+        return self.bulk_marks(request, ShoppingCart)
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk):
+        """Похожие рецепты из таблицы соседей, самые похожие первыми."""
+        recipe = get_object_or_404(Recipe, pk=pk)
+        neighbours = list(SimilarRecipe.objects.filter(
+            recipe=recipe).values_list('similar_id', 'score')[
+            :settings.SIMILAR_RECIPES_TOP_K])
+        recipes = Recipe.objects.in_bulk(
+            [similar_id for similar_id, _ in neighbours])
+        return Response([
+            {**RecipeShortSerializer(recipes[similar_id],
+                                     context={'request': request}).data,
+             'similarity': round(score, 4)}
+            for similar_id, score in neighbours if similar_id in recipes
+        ])
+
+    @action(detail=False, methods=['get'],
+            pagination_class=CustomUsersPagination)
+    def match(self, request):
+        """Рецепты из имеющихся продуктов: ?ingredients=1,2,3. Чем больше
+        доля ингредиентов рецепта среди переданных, тем он выше."""
+        ingredient_ids = parse_ids(request.query_params.getlist('ingredients'))
+        if not ingredient_ids:
+            return Response(
+                {'detail': 'Передайте id ингредиентов в ingredients'},
+                status=status.HTTP_400_BAD_REQUEST)
+        matches = self.paginate_queryset(recipe_match_index.match(
+            ingredient_ids, settings.RECIPE_MATCH_MAX_RESULTS))
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, *_ in matches])
+        matches = [match for match in matches if match[0] in recipes]
+        serializer = self.get_serializer(
+            [recipes[recipe_id] for recipe_id, *_ in matches], many=True)
+        return self.get_paginated_response([
+            {**recipe, 'matched_ingredients': matched,
+             'total_ingredients': total}
+            for recipe, (_, matched, total) in zip(serializer.data, matches)
+        ])
+
+    @action(detail=False, methods=['get'],
+            permission_classes=(permissions.IsAuthenticated,),
+            renderer_classes=EXPORTERS)
     def download_shopping_cart(self, request):
-        ingredients = RecipeIngredientAmount.objects.filter(
-            recipe__in_shopping_carts__user=request.user).values(
-            'ingredient__name',
-            'ingredient__measurement_unit').annotate(
-            total_amount=Sum('amount'))
-        data = ingredients.values_list('ingredient__name',
-                                       'ingredient__measurement_unit',
-                                       'total_amount')
-        shopping_cart = 'Список покупок:\n'
-        for name, measure, amount in data:
-            shopping_cart += f'- {name} в количестве: {amount} {measure},\n'
-        response = HttpResponse(shopping_cart, content_type='text/plain')
+        exporter = request.accepted_renderer
+        etag, last_modified = get_shopping_cart_validators(
+            request.user, exporter.format)
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+        data = ShoppingListItem.objects.filter(
+            user=request.user).order_by('ingredient__name').values_list(
+            'ingredient__name', 'ingredient__measurement_unit',
+            'total_amount')
+        content_type = exporter.media_type
+        if exporter.charset:
+            content_type = f'{content_type}; charset={exporter.charset}'
+        response = StreamingHttpResponse(
+            exporter.stream(normalize_rows(
+                data.iterator(chunk_size=EXPORT_CHUNK_SIZE))),
+            content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="{exporter.filename}"')
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
         return response
+
+
+class MetricsView(APIView):
+    """Счётчики приложения в текстовом формате Prometheus."""
+    permission_classes = (permissions.IsAdminUser,)
+    renderer_classes = (PrometheusRenderer,)
+
+    def get(self, request):
+        return Response(render_prometheus())
+
+
+class ReadinessView(APIView):
+    """Готов ли воркер принимать трафик: основная база отвечает, а в пулах
+    соединений есть свободные. Пул у каждого процесса свой. Без реплики
+    воркер работает, читая с основной базы, поэтому она только помечает
+    ответ как degraded."""
+    authentication_classes = ()
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request):
+        databases = {alias: database_status(alias) for alias in connections}
+        ready = databases[DEFAULT_DB_ALIAS]['ready']
+        degraded = not all(
+            database['ready'] for database in databases.values())
+        return Response(
+            {'ready': ready, 'degraded': degraded, 'databases': databases},
+            status=(status.HTTP_200_OK if ready
+                    else status.HTTP_503_SERVICE_UNAVAILABLE))
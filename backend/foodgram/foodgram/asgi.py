@@ -1,7 +1,23 @@
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+from django.conf import settings  # noqa: E402
+
+from api.offload import StreamingASGIHandler  # noqa: E402
+from foodgram.postgresql.base import enable_statement_timeout  # noqa: E402
+from recipes.autocomplete import ingredient_index  # noqa: E402
+from recipes.matching import recipe_match_index  # noqa: E402
+
+# Как get_asgi_application, но потоковые ответы читаются не в цикле
+# событий
+application = StreamingASGIHandler()
+
+enable_statement_timeout()
+if settings.INGREDIENT_INDEX_ENABLED:
+    ingredient_index.warm()
+recipe_match_index.warm()
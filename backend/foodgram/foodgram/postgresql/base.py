@@ -0,0 +1,82 @@
+import weakref
+
+from django.db.backends.postgresql import base
+
+from .pool import check_connection, get_pool
+
+# Соединения, где statement_timeout уже задан: из пула они возвращаются
+# с ним, повторный SET не нужен
+_timed_connections = weakref.WeakSet()
+_statement_timeout_enabled = False
+
+
+def enable_statement_timeout():
+    """Включает STATEMENT_TIMEOUT в соединениях этого процесса. Вызывается
+    при загрузке приложения сервера, поэтому команды manage.py и тесты
+    работают без ограничения."""
+    global _statement_timeout_enabled
+    _statement_timeout_enabled = True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """Бэкенд PostgreSQL с проверкой постоянных соединений и пулом.
+
+    CONN_HEALTH_CHECKS повторяет настройку Django 4.1: перед первым
+    запросом в каждом запросе к API соединение проверяется SELECT 1
+    и переоткрывается, если база его оборвала. POOL включает пул
+    соединений процесса, см. pool.ConnectionPool. STATEMENT_TIMEOUT
+    в миллисекундах ограничивает время SQL-запроса, если его включил
+    enable_statement_timeout."""
+    health_check_done = True
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict)
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        check = (check_connection
+                 if self.settings_dict.get('CONN_HEALTH_CHECKS') else None)
+        return pool.get(
+            lambda: super(DatabaseWrapper, self).get_new_connection(
+                conn_params),
+            check)
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def init_connection_state(self):
+        super().init_connection_state()
+        timeout = self.settings_dict.get('STATEMENT_TIMEOUT')
+        if (timeout and _statement_timeout_enabled
+                and self.connection not in _timed_connections):
+            with self.connection.cursor() as cursor:
+                cursor.execute('SET statement_timeout = %s', [timeout])
+            _timed_connections.add(self.connection)
+
+    def _close(self):
+        pool = self.pool
+        if pool is None:
+            super()._close()
+            return
+        with self.wrap_database_errors:
+            pool.put(self.connection, discard=self.errors_occurred)
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def close_if_health_check_failed(self):
+        if (self.connection is None or self.health_check_done
+                or not self.settings_dict.get('CONN_HEALTH_CHECKS')):
+            return
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
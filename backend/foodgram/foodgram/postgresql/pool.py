@@ -0,0 +1,110 @@
+import os
+import threading
+
+from psycopg2 import Error, OperationalError, extensions
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """Соединения процесса с базой, общие для всех его потоков.
+
+    Соединение занимается на время запроса и возвращается при его
+    закрытии. Когда свободных нет, поток ждёт до timeout секунд."""
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.idle = []
+        self.in_use = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.condition = threading.Condition()
+
+    def get(self, connect, check=None):
+        """Отдаёт свободное соединение или открывает новое через connect.
+        check проверяет свободное соединение перед выдачей."""
+        with self.condition:
+            if self.in_use >= self.size:
+                self.waits += 1
+                if not self.condition.wait_for(
+                        lambda: self.in_use < self.size, self.timeout):
+                    self.timeouts += 1
+                    raise OperationalError(
+                        f'Нет свободных соединений в пуле за '
+                        f'{self.timeout} с')
+            self.in_use += 1
+            connection = self.idle.pop() if self.idle else None
+        try:
+            if connection is not None and check is not None:
+                if not check(connection):
+                    connection.close()
+                    connection = None
+            if connection is None:
+                connection = connect()
+        except BaseException:
+            self.release()
+            raise
+        return connection
+
+    def put(self, connection, discard=False):
+        """Возвращает соединение в пул, откатив незавершённую транзакцию.
+        Оборванные соединения и соединения с discard закрываются."""
+        try:
+            if not discard and not connection.closed:
+                status = connection.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+        except Error:
+            discard = True
+        if discard or connection.closed:
+            connection.close()
+            connection = None
+        self.release(connection)
+
+    def release(self, connection=None):
+        with self.condition:
+            self.in_use -= 1
+            if connection is not None:
+                self.idle.append(connection)
+            self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'size': self.size,
+                'in_use': self.in_use,
+                'idle': len(self.idle),
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'utilization': round(self.in_use / self.size, 2),
+            }
+
+
+def get_pool(alias, settings_dict, create=True):
+    """Пул процесса для базы alias или None, если пул выключен.
+
+    Пулы создаются лениво и заново после fork, чтобы воркеры gunicorn
+    не делили сокеты родителя."""
+    options = settings_dict.get('POOL') or {}
+    if not options.get('SIZE'):
+        return None
+    key = alias, os.getpid()
+    pool = pools.get(key)
+    if pool is None and create:
+        with pools_lock:
+            pool = pools.setdefault(
+                key, ConnectionPool(options['SIZE'], options['TIMEOUT']))
+    return pool
+
+
+def check_connection(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except Error:
+        return False
+    return True
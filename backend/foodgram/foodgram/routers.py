@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_KEY = 'replica:pin:{}'
+
+# Токены и сессии читаются с основной базы: только что выданные
+# могут ещё не дойти до реплики
+PRIMARY_MODELS = {'authtoken.token', 'sessions.session'}
+# Кеши в памяти процесса: закрепления за основной базой в них не видны
+# другим воркерам
+LOCAL_CACHES = {'django.core.cache.backends.locmem.LocMemCache',
+                'django.core.cache.backends.dummy.DummyCache'}
+
+read_alias = ContextVar('read_alias', default=None)
+primary_only = ContextVar('primary_only', default=False)
+# Реплики, к которым не удалось подключиться: {alias: до какого момента
+# time.monotonic() не использовать}
+_down = {}
+
+
+def get_replicas():
+    return [alias for alias in settings.DATABASES
+            if alias != DEFAULT_DB_ALIAS]
+
+
+def is_available(alias):
+    """Есть ли рабочее соединение с репликой alias. Если подключиться
+    не удалось, реплика не используется DB_REPLICA_RETRY_SECONDS секунд
+    и чтение идёт с основной базы."""
+    if _down.get(alias, 0) > time.monotonic():
+        return False
+    connection = connections[alias]
+    try:
+        check = getattr(connection, 'close_if_health_check_failed', None)
+        if check is not None:
+            check()
+        connection.ensure_connection()
+    except DatabaseError:
+        _down[alias] = time.monotonic() + settings.DB_REPLICA_RETRY_SECONDS
+        logger.warning('Реплика %s недоступна, чтение идёт с основной базы',
+                       alias, exc_info=True)
+        return False
+    return True
+
+
+class PrimaryReplicaRouter:
+    """Чтение в безопасных запросах к API идёт на реплику, выбранную
+    route_reads, запись и всё остальное — на основную базу."""
+
+    def __init__(self):
+        if (get_replicas()
+                and settings.CACHES['default']['BACKEND'] in LOCAL_CACHES):
+            raise ImproperlyConfigured(
+                'Реплики требуют общего кеша: задайте CACHE_BACKEND, '
+                'иначе воркеры не видят закреплений за основной базой')
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower in PRIMARY_MODELS:
+            return DEFAULT_DB_ALIAS
+        alias = read_alias.get()
+        if alias is None or not is_available(alias):
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # Дальнейшее чтение в этом запросе должно видеть запись
+        read_alias.set(None)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def get_client_key(request):
+    """Отпечаток клиента по токену или сессии, None для анонимов."""
+    credentials = (request.META.get('HTTP_AUTHORIZATION')
+                   or request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if not credentials:
+        return None
+    return hashlib.sha256(credentials.encode()).hexdigest()
+
+
+def pin_primary(name):
+    """Следующие DB_REPLICA_STICKY_SECONDS секунд чтение по name идёт
+    с основной базы: изменения могли ещё не дойти до реплик."""
+    if get_replicas():
+        cache.set(PIN_KEY.format(name), True,
+                  timeout=settings.DB_REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(name):
+    return bool(cache.get(PIN_KEY.format(name)))
+
+
+@contextmanager
+def route_reads(request):
+    """Направляет чтение безопасного запроса на случайную доступную
+    реплику.
+
+    После записи клиент какое-то время читает с основной базы, чтобы
+    видеть свои изменения несмотря на отставание реплик."""
+    now = time.monotonic()
+    replicas = [alias for alias in get_replicas()
+                if _down.get(alias, 0) <= now]
+    key = get_client_key(request) if replicas else None
+    alias = None
+    if (replicas and request.method in SAFE_METHODS
+            and not primary_only.get()
+            and (key is None or not is_pinned(key))):
+        alias = random.choice(replicas)
+    token = read_alias.set(alias)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+        if key is not None and request.method not in SAFE_METHODS:
+            pin_primary(key)
+
+
+@contextmanager
+def fresh_reads(*namespaces):
+    """Для заполнения кеша по версиям namespaces: если версия недавно
+    сменилась, данные читаются с основной базы. Иначе под новой версией
+    закешируется отстающая копия с реплики и переживёт её догоняние."""
+    alias = read_alias.get()
+    if alias is not None and any(map(is_pinned, namespaces)):
+        alias = None
+    token = read_alias.set(alias)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """Всё чтение внутри блока идёт с основной базы, в том числе
+    в запросах через тестовый клиент."""
+    token = primary_only.set(True)
+    try:
+        yield
+    finally:
+        primary_only.reset(token)
@@ -31,6 +31,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.QueryMetricsMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,18 +62,74 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
+DB_ENGINE = os.getenv('DB_ENGINE', default='django.db.backends.postgresql')
+if DB_ENGINE == 'django.db.backends.postgresql':
+    # Тот же бэкенд с проверкой соединений и пулом
+    DB_ENGINE = 'foodgram.postgresql'
+# Пул соединений процесса: с ним соединение возвращается в пул в конце
+# каждого запроса, поэтому CONN_MAX_AGE не нужен
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', default=0))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', default=10))
+# transaction: база за PgBouncer в режиме pool_mode = transaction
+DB_POOLER = os.getenv('DB_POOLER', default='')
+# Ограничение SQL-запроса в миллисекундах для запросов к серверу, меньше
+# GUNICORN_TIMEOUT; команды manage.py работают без него
+DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', default=25000))
+
 DATABASES = {
     'default': {
-        'ENGINE': os.getenv('DB_ENGINE',
-                            default='django.db.backends.postgresql'),
+        'ENGINE': DB_ENGINE,
         'NAME': os.getenv('DB_NAME', default='postgres'),
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgres'),
         'HOST': os.getenv('DB_HOST', default='db'),
-        'PORT': os.getenv('DB_PORT', '5432')
+        'PORT': os.getenv('DB_PORT', '5432'),
+        'CONN_MAX_AGE': (0 if DB_POOL_SIZE
+                         else int(os.getenv('DB_CONN_MAX_AGE', default=60))),
+        'CONN_HEALTH_CHECKS': os.getenv(
+            'DB_CONN_HEALTH_CHECKS', default='True') == 'True',
+        'POOL': {'SIZE': DB_POOL_SIZE, 'TIMEOUT': DB_POOL_TIMEOUT},
     }
 }
 
+if DB_ENGINE == 'foodgram.postgresql':
+    if DB_POOLER == 'transaction':
+        # PgBouncer отклоняет параметры запуска и не сохраняет состояние
+        # сессии между транзакциями: таймаут задаётся на роль в базе,
+        # курсоры на сервере недоступны
+        DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+    else:
+        DATABASES['default']['STATEMENT_TIMEOUT'] = DB_STATEMENT_TIMEOUT
+
+# Реплики только для чтения: адреса host[:port] через запятую, для
+# SQLite — пути к файлам. Структуру реплик даёт репликация, migrate
+# применяется только к основной базе.
+DB_REPLICA_HOSTS = [host for host in os.getenv(
+    'DB_REPLICA_HOSTS', default='').split(',') if host]
+for number, host in enumerate(DB_REPLICA_HOSTS, start=1):
+    replica = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if DB_ENGINE == 'django.db.backends.sqlite3':
+        replica['NAME'] = host
+    else:
+        host, _, port = host.partition(':')
+        replica.update(
+            HOST=host,
+            PORT=port or replica['PORT'],
+            USER=os.getenv('DB_REPLICA_USER', default=replica['USER']),
+            PASSWORD=os.getenv('DB_REPLICA_PASSWORD',
+                               default=replica['PASSWORD']),
+        )
+    DATABASES[f'replica{number}'] = replica
+
+DATABASE_ROUTERS = ['foodgram.routers.PrimaryReplicaRouter']
+# Сколько секунд после записи клиент читает с основной базы
+DB_REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS',
+                                          default=5))
+# Через сколько секунд снова пробовать реплику, к которой не удалось
+# подключиться
+DB_REPLICA_RETRY_SECONDS = int(os.getenv('DB_REPLICA_RETRY_SECONDS',
+                                         default=10))
+
 # DATABASES = {
 #    'default': {
 #        'ENGINE': 'django.db.backends.sqlite3',
@@ -79,6 +137,21 @@ DATABASES = {
 #    }
 # }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    }
+}
+
+REFERENCE_CACHE_TIMEOUT = int(os.getenv('REFERENCE_CACHE_TIMEOUT',
+                                        default=24 * 60 * 60))
+
+RECIPE_PAGE_CACHE_TIMEOUT = int(os.getenv('RECIPE_PAGE_CACHE_TIMEOUT',
+                                          default=5 * 60))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -123,6 +196,83 @@ REST_FRAMEWORK = {
     ],
 }
 
+# wsgi или asgi: под ASGI чтение рецептов, тегов, ингредиентов и списка
+# покупок выполняется в пуле из ASGI_READ_THREADS потоков на процесс.
+# Каждый поток держит своё соединение с базой.
+SERVER_MODE = os.getenv('SERVER_MODE', default='wsgi')
+ASGI_READ_THREADS = int(os.getenv('ASGI_READ_THREADS', default=8))
+
+# Server-Timing для всех клиентов; сотрудники получают его всегда
+SERVER_TIMING = os.getenv('SERVER_TIMING', default='False') == 'True'
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL',
+                                         default=10))
+# Сколько SQL-запросов может выполнить экшен (basename.action). Сверх
+# бюджета пишется предупреждение, с QUERY_BUDGET_RAISE — исключение.
+# QUERY_BUDGETS в окружении дополняет и переопределяет значения ниже:
+# action=число через запятую.
+QUERY_BUDGETS = {
+    'recipes.list': 8,
+    'recipes.retrieve': 5,
+    'recipes.similar': 4,
+    'recipes.match': 6,
+    'recipes.download_shopping_cart': 3,
+    'users.list': 3,
+    'users.subscriptions': 4,
+    'users.shopping_list': 2,
+    'tags.list': 2,
+    'ingredients.list': 2,
+}
+for budget in os.getenv('QUERY_BUDGETS', default='').split(','):
+    if budget:
+        view, _, queries = budget.partition('=')
+        QUERY_BUDGETS[view.strip()] = int(queries)
+QUERY_BUDGET_RAISE = os.getenv('QUERY_BUDGET_RAISE', default='False') == 'True'
+
+INGREDIENT_INDEX_ENABLED = os.getenv(
+    'INGREDIENT_INDEX_ENABLED', default='True') == 'True'
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', default=300))
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', default=50))
+
+RECIPE_MATCH_INDEX_TTL = int(os.getenv('RECIPE_MATCH_INDEX_TTL', default=3600))
+RECIPE_MATCH_MAX_REPLAY = int(os.getenv('RECIPE_MATCH_MAX_REPLAY',
+                                        default=1000))
+RECIPE_MATCH_MAX_RESULTS = int(os.getenv('RECIPE_MATCH_MAX_RESULTS',
+                                         default=500))
+
+# Лента, карточка и подбор рецептов собираются из готовых документов
+# RecipeDocument. После включения нужно выполнить rebuild_recipe_documents.
+RECIPE_DOCUMENTS_ENABLED = os.getenv(
+    'RECIPE_DOCUMENTS_ENABLED', default='True') == 'True'
+
+BULK_RECIPES_LIMIT = int(os.getenv('BULK_RECIPES_LIMIT', default=100))
+
+SIMILAR_RECIPES_TOP_K = int(os.getenv('SIMILAR_RECIPES_TOP_K', default=10))
+SIMILAR_RECIPES_TAG_WEIGHT = float(os.getenv('SIMILAR_RECIPES_TAG_WEIGHT',
+                                             default=0.5))
+SIMILAR_RECIPES_INDEX_TTL = int(os.getenv('SIMILAR_RECIPES_INDEX_TTL',
+                                          default=3600))
+SIMILAR_RECIPES_MAX_REPLAY = int(os.getenv('SIMILAR_RECIPES_MAX_REPLAY',
+                                           default=1000))
+
+# После изменения нужно выполнить rebuild_counters. Вклад отметки
+# удваивается за период полураспада от эпохи; TRENDING_EPOCH — её
+# начальное значение, дальше эпоха хранится в базе и сдвигается вперёд
+# автоматически, не давая рейтингу выйти за пределы float.
+TRENDING_HALF_LIFE_HOURS = float(os.getenv('TRENDING_HALF_LIFE_HOURS',
+                                           default=168))
+TRENDING_EPOCH = os.getenv('TRENDING_EPOCH', default='2023-01-01')
+
+# Конфигурация полнотекстового поиска PostgreSQL
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', default='russian')
+
+MAX_IMAGE_UPLOAD_SIZE = int(os.getenv('MAX_IMAGE_UPLOAD_SIZE',
+                                      default=5 * 1024 * 1024))
+IMAGE_RENDITION_WORKERS = int(os.getenv('IMAGE_RENDITION_WORKERS', default=2))
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'HIDE_USERS': False,
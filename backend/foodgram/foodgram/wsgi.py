@@ -5,3 +5,14 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+from foodgram.postgresql.base import enable_statement_timeout  # noqa: E402
+from recipes.autocomplete import ingredient_index  # noqa: E402
+from recipes.matching import recipe_match_index  # noqa: E402
+
+enable_statement_timeout()
+if settings.INGREDIENT_INDEX_ENABLED:
+    ingredient_index.warm()
+recipe_match_index.warm()
@@ -0,0 +1,38 @@
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Один конфиг для обоих режимов: SERVER_MODE=wsgi — синхронные воркеры
+# (или gthread при GUNICORN_THREADS > 1), SERVER_MODE=asgi — воркеры
+# uvicorn, где чтение выполняется в пуле ASGI_READ_THREADS потоков.
+server_mode = os.getenv('SERVER_MODE', 'wsgi')
+cpu_count = multiprocessing.cpu_count()
+# Версии кеша и закрепление чтения за основной базой хранятся в кеше:
+# с кешем в памяти процесса другие воркеры их не видят, поэтому
+# по умолчанию воркер один, а больше одного требует общего кеша
+local_cache = os.getenv(
+    'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+).rsplit('.', 1)[-1] in ('LocMemCache', 'DummyCache')
+
+bind = os.getenv('GUNICORN_BIND', '0:8000')
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+
+if server_mode == 'asgi':
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    default_workers = cpu_count
+else:
+    wsgi_app = 'foodgram.wsgi:application'
+    threads = int(os.getenv('GUNICORN_THREADS', 1))
+    worker_class = 'gthread' if threads > 1 else 'sync'
+    default_workers = cpu_count * 2 + 1
+
+workers = int(os.getenv('WEB_CONCURRENCY',
+                        1 if local_cache else default_workers))
+if workers > 1 and local_cache:
+    raise RuntimeError(
+        'WEB_CONCURRENCY > 1 требует общего кеша: задайте CACHE_BACKEND, '
+        'например FileBasedCache или PyMemcacheCache')
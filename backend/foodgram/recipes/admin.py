@@ -8,11 +8,12 @@ from .models import (Favorite, Ingredient, Recipe, RecipeIngredientAmount,
 class RecipeAdmin(admin.ModelAdmin):
     list_display = ('name', 'author', 'count_favorites')
     list_filter = ('author', 'name', 'tags',)
+    readonly_fields = ('favorites_count', 'carts_count', 'trending_score')
     empty_value_display = '-пусто-'
 
     @staticmethod
     def count_favorites(obj):
-        return obj.in_favorites.count()
+        return obj.favorites_count
     count_favorites.short_description = 'Число добавлений в избранноe'
 
 
@@ -0,0 +1,80 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from foodgram.routers import fresh_reads
+
+from .cache import INGREDIENTS_NAMESPACE, get_version
+from .models import Ingredient
+
+
+class IngredientIndex:
+    """Индекс названий ингредиентов в памяти процесса для автодополнения.
+
+    Названия хранятся отсортированными по casefold, поиск по префиксу —
+    бинарный поиск по этому списку, без обращения к базе. Индекс
+    перестраивается при смене версии ингредиентов в кеше (её повышают
+    сигналы) и не реже раза в INGREDIENT_INDEX_TTL секунд: с кешем
+    в памяти процесса изменения из других процессов видны только так."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def invalidate(self):
+        self._state = None
+
+    def warm(self):
+        """Строит индекс заранее; без доступа к базе он построится
+        при первом запросе."""
+        try:
+            self._get_state()
+        except DatabaseError:
+            self.invalidate()
+
+    @staticmethod
+    def _build(version):
+        rows = sorted(
+            (name.casefold(), name, pk, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit')
+        )
+        keys = [row[0] for row in rows]
+        items = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, name, pk, measurement_unit in rows
+        ]
+        return keys, items, time.monotonic(), version
+
+    def _get_state(self):
+        state = self._state
+        version = get_version(INGREDIENTS_NAMESPACE)
+        ttl = settings.INGREDIENT_INDEX_TTL
+        if (state is None or state[3] != version
+                or time.monotonic() - state[2] > ttl):
+            with self._lock:
+                if self._state is state:
+                    with fresh_reads(INGREDIENTS_NAMESPACE):
+                        self._state = self._build(version)
+                state = self._state
+        return state
+
+    def all(self):
+        return self._get_state()[1]
+
+    def search(self, prefix, limit):
+        keys, items, *_ = self._get_state()
+        prefix = prefix.casefold()
+        result = []
+        position = bisect_left(keys, prefix)
+        while (position < len(keys) and len(result) < limit
+               and keys[position].startswith(prefix)):
+            result.append(items[position])
+            position += 1
+        return result
+
+
+ingredient_index = IngredientIndex()
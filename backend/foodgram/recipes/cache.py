@@ -0,0 +1,52 @@
+import time
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+
+from foodgram.routers import pin_primary
+
+VERSION_KEY = 'version:{}'
+INGREDIENTS_NAMESPACE = 'ingredients'
+TAGS_NAMESPACE = 'tags'
+RECIPES_NAMESPACE = 'recipes'
+RECIPE_INGREDIENTS_NAMESPACE = 'recipe_ingredients'
+SIMILAR_FEATURES_NAMESPACE = 'similar_features'
+
+
+def user_namespace(user_id):
+    """Поколение данных пользователя: избранное, корзина, подписки."""
+    return f'user:{user_id}'
+
+
+def get_version(namespace):
+    """Текущая версия данных namespace в общем кеше.
+
+    Закешированные ответы включают версию в ключ, поэтому смена версии
+    инвалидирует их все сразу. Отсутствующая версия (кеш очищен или
+    вытеснен) начинается со времени в миллисекундах, чтобы не совпасть
+    ни с одной из выданных ранее."""
+    key = VERSION_KEY.format(namespace)
+    version = cache.get(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(namespace):
+    pin_primary(namespace)
+    key = VERSION_KEY.format(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = int(time.time() * 1000)
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def bump_on_commit(namespace):
+    """Повышает версию после коммита, чтобы закешированная между записью
+    и коммитом страница не пережила инвалидацию."""
+    transaction.on_commit(partial(bump_version, namespace))
@@ -0,0 +1,168 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import (Case, Count, F, FloatField, OuterRef, Subquery,
+                              Value, When)
+from django.db.models.functions import Coalesce, Greatest
+
+from users.models import Subscription
+from .models import Favorite, Recipe, ShoppingCart, TrendingEpoch
+
+User = get_user_model()
+
+RECIPE_COUNTERS = {
+    Favorite: 'favorites_count',
+    ShoppingCart: 'carts_count',
+}
+TRENDING_WEIGHTS = {
+    Favorite: 1.0,
+    ShoppingCart: 0.5,
+}
+TRENDING_BATCH_SIZE = 1000
+# 2 ** 1024 уже не float. Эпоха сдвигается, когда вклад новой отметки
+# доходит до 2 ** REBASE_EXPONENT: запаса хватает на сумму вкладов и
+# на отметки, посчитанные до сдвига
+REBASE_EXPONENT = 512
+MAX_EXPONENT = 1000
+# Ключ advisory-блокировки PostgreSQL: отметки берут её разделяемой,
+# сдвиг эпохи — исключительной
+TRENDING_LOCK_ID = 0x7472656e64
+
+
+def change_counters(model, pk, **deltas):
+    """Атомарно меняет счётчики на заданные величины, не опуская их
+    ниже нуля."""
+    model.objects.filter(pk=pk).update(**{
+        field: Greatest(F(field) + delta, 0)
+        for field, delta in deltas.items()
+    })
+
+
+def count_marks(model, marks, delta):
+    """Учитывает delta отметок model (избранное или корзина) в счётчике
+    и рейтинге trending рецептов одним UPDATE. marks — даты отметок
+    по id рецептов: {recipe_id: added_date}."""
+    with transaction.atomic():
+        lock_epoch(shared=True)
+        epoch = get_epoch()
+        latest = max(marks.values())
+        if trending_exponent(latest, epoch) > REBASE_EXPONENT:
+            epoch = rebase_trending_scores(latest)
+        weights = {pk: delta * trending_weight(model, added_date, epoch)
+                   for pk, added_date in marks.items()}
+        if len(set(weights.values())) == 1:
+            score = Value(next(iter(weights.values())))
+        else:
+            score = Case(*[When(pk=pk, then=Value(weight))
+                           for pk, weight in weights.items()],
+                         output_field=FloatField())
+        Recipe.objects.filter(pk__in=marks).update(**{
+            field: Greatest(F(field) + value, 0)
+            for field, value in (
+                (RECIPE_COUNTERS[model], delta),
+                ('trending_score', score),
+            )
+        })
+
+
+def lock_epoch(shared):
+    """Не даёт сдвинуть эпоху между чтением и записью рейтинга.
+
+    В SQLite записи и так идут по одной, блокировка не нужна."""
+    if connection.vendor != 'postgresql':
+        return
+    function = ('pg_advisory_xact_lock_shared' if shared
+                else 'pg_advisory_xact_lock')
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {function}(%s)', [TRENDING_LOCK_ID])
+
+
+def get_epoch():
+    """Текущая эпоха; вначале это TRENDING_EPOCH из настроек."""
+    epoch, _ = TrendingEpoch.objects.get_or_create(pk=1, defaults={
+        'epoch': datetime.fromisoformat(settings.TRENDING_EPOCH).replace(
+            tzinfo=timezone.utc)})
+    return epoch.epoch
+
+
+def trending_exponent(added_date, epoch):
+    hours = (added_date - epoch).total_seconds() / 3600
+    return hours / settings.TRENDING_HALF_LIFE_HOURS
+
+
+def trending_weight(model, added_date, epoch):
+    """Вклад отметки в trending_score.
+
+    Вместо затухания старых вкладов новые удваиваются за каждый период
+    полураспада от эпохи. Порядок рецептов тот же, что у суммы
+    с затуханием, но хранимый рейтинг не нужно пересчитывать со временем:
+    он меняется только при добавлении и удалении отметок. Вклады,
+    разделённые больше чем 53 периодами, во float не складываются:
+    старый при затухании тоже был бы меньше 2 ** -53 нового."""
+    exponent = min(trending_exponent(added_date, epoch), MAX_EXPONENT)
+    return TRENDING_WEIGHTS[model] * 2 ** exponent
+
+
+def rebase_trending_scores(now=None):
+    """Сдвигает эпоху на целое число k периодов полураспада к now и
+    делит все рейтинги на 2 ** k: порядок рецептов не меняется, а
+    вклады новых отметок снова начинаются с единиц. Совсем старые
+    рейтинги при этом уходят в ноль, как при затухании. Возвращает
+    новую эпоху."""
+    now = now or datetime.now(timezone.utc)
+    with transaction.atomic():
+        lock_epoch(shared=False)
+        epoch = get_epoch()
+        shift = int(trending_exponent(now, epoch))
+        if shift <= 0:
+            return epoch
+        scores = Recipe.objects.exclude(trending_score=0)
+        if shift > MAX_EXPONENT:
+            scores.update(trending_score=0)
+        else:
+            scores.update(trending_score=F('trending_score') / 2.0 ** shift)
+        epoch += timedelta(hours=shift * settings.TRENDING_HALF_LIFE_HOURS)
+        TrendingEpoch.objects.filter(pk=1).update(epoch=epoch)
+    return epoch
+
+
+def count_subquery(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def rebuild_trending_scores():
+    with transaction.atomic():
+        epoch = rebase_trending_scores()
+        lock_epoch(shared=False)
+        scores = defaultdict(float)
+        for model in TRENDING_WEIGHTS:
+            marks = model.objects.order_by().values_list('recipe_id',
+                                                         'added_date')
+            for recipe_id, added_date in marks.iterator(
+                    chunk_size=TRENDING_BATCH_SIZE):
+                scores[recipe_id] += trending_weight(model, added_date,
+                                                     epoch)
+        Recipe.objects.exclude(trending_score=0).update(trending_score=0)
+        Recipe.objects.bulk_update(
+            [Recipe(pk=pk, trending_score=score)
+             for pk, score in scores.items()],
+            ['trending_score'], batch_size=TRENDING_BATCH_SIZE)
+
+
+def rebuild_counters():
+    """Пересчитывает все счётчики и рейтинги по исходным таблицам."""
+    Recipe.objects.update(
+        favorites_count=count_subquery(Favorite, 'recipe'),
+        carts_count=count_subquery(ShoppingCart, 'recipe'),
+    )
+    User.objects.update(
+        recipes_count=count_subquery(Recipe, 'author'),
+        subscribers_count=count_subquery(Subscription, 'author'),
+    )
+    rebuild_trending_scores()
@@ -0,0 +1,323 @@
+import json
+import math
+import platform
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.db.models import Max
+from django.test import Client
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api.documents import refresh_recipe_documents
+from api.filters import RECIPE_ORDERINGS
+from api.middleware import count_queries
+from foodgram.routers import use_primary
+from recipes.cache import (INGREDIENTS_NAMESPACE, RECIPES_NAMESPACE,
+                           TAGS_NAMESPACE, bump_version)
+from recipes.counters import rebuild_counters
+from recipes.models import (Favorite, Ingredient, Recipe,
+                            RecipeIngredientAmount, ShoppingCart, Tag)
+from recipes.search import refresh_search_documents
+from recipes.shopping_list import rebuild_shopping_lists
+from users.models import Subscription
+
+User = get_user_model()
+
+BATCH_SIZE = 10000
+WORDS = ('мука', 'сахар', 'соль', 'молоко', 'масло', 'яйцо', 'перец',
+         'томат', 'сыр', 'рис', 'лук', 'чеснок', 'морковь', 'курица')
+UNITS = ('г', 'кг', 'мл', 'шт.', 'ст. л.', 'ч. л.')
+
+
+def percentile(values, fraction):
+    """Процентиль по ближайшему рангу."""
+    values = sorted(values)
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный замер основных эндпоинтов API через тестовый '
+            'клиент: p50/p95, SQL-запросы и пиковая память на запрос. '
+            'Синтетические данные создаются в транзакции, которая в конце '
+            'откатывается. Результат можно сохранить в JSON и сравнить '
+            'с прошлым прогоном.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--tags', type=int, default=10)
+        parser.add_argument('--favorites', type=int, default=100000)
+        parser.add_argument('--carts', type=int, default=20000)
+        parser.add_argument('--subscriptions', type=int, default=20000)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--warm', action='store_true',
+                            help='Не очищать кеш перед каждым запросом')
+        parser.add_argument('--output', help='Сохранить результат в JSON')
+        parser.add_argument('--compare',
+                            help='JSON прошлого прогона для сравнения')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Допустимый рост p95 при сравнении')
+
+    def handle(self, *args, **options):
+        self.check_scale(options)
+        self.repeat = options['repeat']
+        self.warm = options['warm']
+        # Сгенерированные данные не закоммичены и видны только основной
+        # базе
+        with transaction.atomic(), use_primary():
+            started = time.perf_counter()
+            user, tags = self.seed(options)
+            self.stdout.write(
+                f'Данные созданы за {time.perf_counter() - started:.1f}с')
+            results = self.run(self.get_endpoints(user, tags), user)
+            transaction.set_rollback(True)
+        report = {
+            'meta': {
+                'date': timezone.now().isoformat(),
+                'vendor': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'warm': self.warm,
+                'repeat': self.repeat,
+                'scale': {name: options[name] for name in (
+                    'users', 'recipes', 'ingredients',
+                    'ingredients_per_recipe', 'tags', 'favorites', 'carts',
+                    'subscriptions')},
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        if options['compare']:
+            self.compare(options['compare'], results, options['tolerance'])
+
+    @staticmethod
+    def check_scale(options):
+        users, recipes = options['users'], options['recipes']
+        if users < 2 or recipes < 1:
+            raise CommandError('Нужно хотя бы 2 пользователя и 1 рецепт')
+        if options['ingredients_per_recipe'] > options['ingredients']:
+            raise CommandError('--ingredients-per-recipe больше, чем '
+                               '--ingredients')
+        if max(options['favorites'], options['carts']) > users * recipes:
+            raise CommandError('Избранного и корзин не может быть больше, '
+                               'чем пользователей, умноженных на рецепты')
+        if options['subscriptions'] > users * (users - 1):
+            raise CommandError('Слишком много подписок для --users')
+
+    def seed(self, options):
+        """Пары в избранном, корзинах и подписках получаются по формуле
+        из номера записи и не повторяются, поэтому прогоны с одинаковыми
+        параметрами сравнимы между собой."""
+        User.objects.bulk_create(
+            [User(username=f'benchmark_{number}',
+                  email=f'benchmark_{number}@example.com',
+                  first_name='Бенчмарк', last_name=str(number))
+             for number in range(options['users'])],
+            batch_size=BATCH_SIZE)
+        user_ids = list(User.objects.filter(
+            username__startswith='benchmark_').order_by('pk').values_list(
+            'pk', flat=True))
+        tags = Tag.objects.bulk_create([
+            Tag(name=f'benchmark {number}', slug=f'benchmark-{number}',
+                color=f'#b{number:05x}')
+            for number in range(options['tags'])])
+        tag_ids = list(Tag.objects.filter(
+            slug__startswith='benchmark-').values_list('pk', flat=True))
+        last_ingredient = self.get_last_pk(Ingredient)
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=f'{WORDS[number % len(WORDS)]} {number}',
+                        measurement_unit=UNITS[number % len(UNITS)])
+             for number in range(options['ingredients'])],
+            batch_size=BATCH_SIZE)
+        ingredient_ids = list(Ingredient.objects.filter(
+            pk__gt=last_ingredient).order_by('pk').values_list(
+            'pk', flat=True))
+        last_recipe = self.get_last_pk(Recipe)
+        Recipe.objects.bulk_create(
+            [Recipe(author_id=user_ids[number % len(user_ids)],
+                    name=f'{WORDS[number % len(WORDS)]} по-домашнему '
+                         f'{number}',
+                    text=f'Смешать и запекать {number % 60 + 10} минут.',
+                    cooking_time=number % 120 + 1)
+             for number in range(options['recipes'])],
+            batch_size=BATCH_SIZE)
+        recipe_ids = list(Recipe.objects.filter(
+            pk__gt=last_recipe).order_by('pk').values_list(
+            'pk', flat=True))
+        self.bulk_create(Recipe.tags.through, (
+            Recipe.tags.through(recipe_id=recipe_id,
+                                tag_id=tag_ids[(number + shift)
+                                               % len(tag_ids)])
+            for number, recipe_id in enumerate(recipe_ids)
+            for shift in range(number % min(3, len(tag_ids)) + 1)))
+        per_recipe = options['ingredients_per_recipe']
+        self.bulk_create(RecipeIngredientAmount, (
+            RecipeIngredientAmount(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_ids[
+                    (number * 31 + shift) % len(ingredient_ids)],
+                amount=(number + shift) % 500 + 1)
+            for number, recipe_id in enumerate(recipe_ids)
+            for shift in range(per_recipe)))
+        for model, count in ((Favorite, options['favorites']),
+                             (ShoppingCart, options['carts'])):
+            self.bulk_create(model, (
+                model(user_id=user_ids[number % len(user_ids)],
+                      recipe_id=recipe_ids[
+                          (number // len(user_ids)
+                           + number % len(user_ids) * 7919)
+                          % len(recipe_ids)])
+                for number in range(count)))
+        self.bulk_create(Subscription, (
+            Subscription(
+                user_id=user_ids[number % len(user_ids)],
+                author_id=user_ids[
+                    (number % len(user_ids) + 1 + number // len(user_ids))
+                    % len(user_ids)])
+            for number in range(options['subscriptions'])))
+        # bulk_create не отправляет сигналы: производные данные
+        # пересчитываются целиком
+        rebuild_counters()
+        rebuild_shopping_lists()
+        for start in range(0, len(recipe_ids), BATCH_SIZE):
+            refresh_search_documents(recipe_ids[start:start + BATCH_SIZE])
+        if settings.RECIPE_DOCUMENTS_ENABLED:
+            refresh_recipe_documents(recipe_ids)
+        for namespace in (RECIPES_NAMESPACE, TAGS_NAMESPACE,
+                          INGREDIENTS_NAMESPACE):
+            bump_version(namespace)
+        self.recipe_ids = recipe_ids
+        return (User.objects.get(pk=user_ids[0]),
+                [tag.slug for tag in tags[:2]])
+
+    @staticmethod
+    def get_last_pk(model):
+        return model.objects.aggregate(last=Max('pk'))['last'] or 0
+
+    @staticmethod
+    def bulk_create(model, objects):
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_create(batch)
+                batch = []
+        model.objects.bulk_create(batch)
+
+    def get_endpoints(self, user, tags):
+        """Имя эндпоинта и функция, которая возвращает URL для прогона
+        number: деталь рецепта каждый раз запрашивает другой рецепт."""
+        tag_query = '&'.join(f'tags={slug}' for slug in tags)
+        word = WORDS[0]
+        lists = {
+            'recipes.list': '',
+            'recipes.list?author': f'author={user.pk}',
+            'recipes.list?tags=any': tag_query,
+            'recipes.list?tags=all': f'{tag_query}&tags_mode=all',
+            'recipes.list?is_favorited': 'is_favorited=1',
+            'recipes.list?is_in_shopping_cart': 'is_in_shopping_cart=1',
+            'recipes.list?search': f'search={word}',
+            'recipes.list?combined': (f'{tag_query}&is_favorited=1'
+                                      f'&ordering=popular'),
+        }
+        lists.update({
+            f'recipes.list?ordering={ordering}': f'ordering={ordering}'
+            for ordering in RECIPE_ORDERINGS
+        })
+        endpoints = {
+            name: (lambda number, query=query:
+                   f'/api/recipes/?limit=6&{query}')
+            for name, query in lists.items()
+        }
+        recipe_ids = self.recipe_ids
+        endpoints.update({
+            'recipes.retrieve': lambda number: (
+                f'/api/recipes/'
+                f'{recipe_ids[number * 7919 % len(recipe_ids)]}/'),
+            'users.subscriptions': lambda number: (
+                '/api/users/subscriptions/?limit=6&recipes_limit=3'),
+            'recipes.download_shopping_cart': lambda number: (
+                '/api/recipes/download_shopping_cart/?format=txt'),
+            'ingredients.list': lambda number: (
+                f'/api/ingredients/?name={WORDS[number % len(WORDS)][:2]}'),
+        })
+        return endpoints
+
+    def run(self, endpoints, user):
+        client = Client(HTTP_AUTHORIZATION='Token {}'.format(
+            Token.objects.create(user=user).key))
+        self.stdout.write(f'{"endpoint":<40} {"p50":>9} {"p95":>9} '
+                          f'{"queries":>7} {"peak":>9}')
+        results = {}
+        for name, get_url in endpoints.items():
+            # Первый запрос прогревает индексы в памяти и не учитывается
+            self.request(client, get_url(0))
+            timings, queries = [], []
+            for number in range(self.repeat):
+                duration, count = self.request(client, get_url(number))
+                timings.append(duration * 1000)
+                queries.append(count)
+            tracemalloc.start()
+            self.request(client, get_url(0))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[name] = {
+                'p50_ms': round(statistics.median(timings), 3),
+                'p95_ms': round(percentile(timings, 0.95), 3),
+                'queries': max(queries),
+                'peak_kib': round(peak / 1024, 1),
+            }
+            result = results[name]
+            self.stdout.write(
+                f'{name:<40} {result["p50_ms"]:>7.2f}ms '
+                f'{result["p95_ms"]:>7.2f}ms {result["queries"]:>7} '
+                f'{result["peak_kib"]:>6.0f}KiB')
+        return results
+
+    def request(self, client, url):
+        if not self.warm:
+            cache.clear()
+        reset_queries()
+        with count_queries() as counter:
+            started = time.perf_counter()
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            duration = time.perf_counter() - started
+        if response.status_code != 200:
+            raise CommandError(f'{url}: ответ {response.status_code}')
+        return duration, counter.queries
+
+    def compare(self, path, results, tolerance):
+        with open(path, encoding='utf-8') as file:
+            baseline = json.load(file)['results']
+        regressions = []
+        self.stdout.write(f'{"endpoint":<40} {"p95 было":>10} '
+                          f'{"p95 стало":>10} {"queries":>9}')
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            slower = result['p95_ms'] > before['p95_ms'] * (1 + tolerance)
+            more_queries = result['queries'] > before['queries']
+            if slower or more_queries:
+                regressions.append(name)
+            self.stdout.write(
+                f'{name:<40} {before["p95_ms"]:>8.2f}ms '
+                f'{result["p95_ms"]:>8.2f}ms '
+                f'{before["queries"]:>4}->{result["queries"]:<4}'
+                + (' !' if slower or more_queries else ''))
+        if regressions:
+            raise CommandError('Регрессии: ' + ', '.join(regressions))
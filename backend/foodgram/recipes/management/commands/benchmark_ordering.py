@@ -0,0 +1,98 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+
+from api.filters import RECIPE_ORDERINGS
+from recipes.counters import rebuild_counters
+from recipes.models import Favorite, Recipe
+
+User = get_user_model()
+
+BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = ('Замеряет первую страницу ленты при каждой сортировке на '
+            'растущем числе избранного. Данные создаются в транзакции, '
+            'которая в конце откатывается.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--steps', default='10000,100000,1000000',
+                            help='Число избранного на каждом шаге')
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--limit', type=int, default=6)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            steps = sorted(int(step) for step in options['steps'].split(','))
+        except ValueError:
+            raise CommandError('--steps: список целых чисел через запятую')
+        self.limit = options['limit']
+        self.repeat = options['repeat']
+        self.users = {}
+        with transaction.atomic():
+            recipes = self.create_recipes(options['recipes'])
+            self.stdout.write('favorites  ' + '  '.join(
+                f'{name:>12}' for name in self.get_queries()))
+            created = 0
+            for step in steps:
+                created = self.create_favorites(recipes, created, step)
+                rebuild_counters()
+                timings = [self.measure(query)
+                           for query in self.get_queries().values()]
+                self.stdout.write(f'{created:>9}  ' + '  '.join(
+                    f'{timing:>10.2f}ms' for timing in timings))
+            transaction.set_rollback(True)
+
+    def get_queries(self):
+        queries = {
+            name: Recipe.objects.order_by(*ordering)
+            for name, ordering in RECIPE_ORDERINGS.items()
+        }
+        # Для сравнения: подсчёт избранного во время запроса
+        queries['aggregate'] = Recipe.objects.annotate(
+            favorites=Count('in_favorites')).order_by('-favorites', '-id')
+        return queries
+
+    def measure(self, queryset):
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            list(queryset.values_list('pk', flat=True)[:self.limit])
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    @staticmethod
+    def create_recipes(count):
+        author = User.objects.create(username='benchmark_author',
+                                     email='benchmark_author@example.com')
+        Recipe.objects.bulk_create(
+            [Recipe(author=author, name=f'benchmark {number}',
+                    text='benchmark', cooking_time=number % 120 + 1)
+             for number in range(count)],
+            batch_size=BATCH_SIZE)
+        return list(Recipe.objects.filter(author=author).values_list(
+            'pk', flat=True))
+
+    def create_favorites(self, recipes, start, stop):
+        """Пользователь number // len(recipes) добавляет рецепт
+        number % len(recipes), так что пары не повторяются."""
+        users = self.users
+        for offset in range(start, stop, BATCH_SIZE):
+            favorites = []
+            for number in range(offset, min(offset + BATCH_SIZE, stop)):
+                user_number = number // len(recipes)
+                if user_number not in users:
+                    users[user_number] = User.objects.create(
+                        username=f'benchmark_{user_number}',
+                        email=f'benchmark_{user_number}@example.com').pk
+                favorites.append(Favorite(
+                    user_id=users[user_number],
+                    recipe_id=recipes[number % len(recipes)]))
+            Favorite.objects.bulk_create(favorites, batch_size=BATCH_SIZE)
+        return stop
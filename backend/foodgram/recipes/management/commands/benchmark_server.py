@@ -0,0 +1,94 @@
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from .benchmark_api import percentile
+
+DEFAULT_PATHS = (
+    '/api/recipes/?limit=6',
+    '/api/recipes/download_shopping_cart/?format=txt',
+    '/api/tags/',
+    '/api/ingredients/?name=са',
+)
+
+
+class Command(BaseCommand):
+    help = ('Замеряет пропускную способность запущенного сервера при '
+            'нескольких уровнях параллельности, чтобы сравнить режимы '
+            'SERVER_MODE=wsgi и SERVER_MODE=asgi на одних данных.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base', default='http://127.0.0.1:8000')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Путь эндпоинта, можно несколько раз')
+        parser.add_argument('--token', help='Токен для авторизации')
+        parser.add_argument('--concurrency', default='1,8,32',
+                            help='Уровни параллельности через запятую')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Запросов на каждый уровень')
+        parser.add_argument('--output', help='Сохранить результат в JSON')
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level)
+                      for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError('--concurrency: целые числа через запятую')
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        paths = options['paths'] or DEFAULT_PATHS
+        self.stdout.write(f'{"path":<50} {"conc":>4} {"rps":>8} '
+                          f'{"p50":>9} {"p95":>9} {"errors":>6}')
+        results = []
+        for path in paths:
+            url = options['base'].rstrip('/') + path
+            for level in levels:
+                result = self.measure(url, headers, level,
+                                      options['requests'])
+                results.append({'path': path, 'concurrency': level,
+                                **result})
+                self.stdout.write(
+                    f'{path:<50} {level:>4} {result["rps"]:>8.1f} '
+                    f'{result["p50_ms"]:>7.1f}ms {result["p95_ms"]:>7.1f}ms '
+                    f'{result["errors"]:>6}')
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({'base': options['base'], 'results': results},
+                          file, ensure_ascii=False, indent=2)
+
+    @staticmethod
+    def measure(url, headers, concurrency, count):
+        local = threading.local()
+
+        def fetch(number):
+            # У каждого потока своя сессия с keep-alive
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+            session = local.session
+            started = time.perf_counter()
+            try:
+                response = session.get(url, headers=headers, timeout=60)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            return time.perf_counter() - started, ok
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            # Прогрев: индексы в памяти и соединения с базой
+            list(pool.map(fetch, range(concurrency)))
+            started = time.perf_counter()
+            samples = list(pool.map(fetch, range(count)))
+            elapsed = time.perf_counter() - started
+        timings = [duration * 1000 for duration, _ in samples]
+        return {
+            'rps': round(count / elapsed, 1),
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'errors': sum(not ok for _, ok in samples),
+        }
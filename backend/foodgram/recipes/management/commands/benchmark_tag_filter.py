@@ -0,0 +1,110 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.http import QueryDict
+
+from api.filters import RecipesFilter
+from recipes.cache import TAGS_NAMESPACE, bump_version
+from recipes.models import Recipe, Tag
+
+User = get_user_model()
+
+BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает фильтр по тегам через подзапрос с JOIN и DISTINCT '
+            'на первой странице ленты с подсчётом. Данные создаются '
+            'в транзакции, которая в конце откатывается.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=50000)
+        parser.add_argument('--tags', type=int, default=20)
+        parser.add_argument('--limit', type=int, default=6)
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        self.limit = options['limit']
+        self.repeat = options['repeat']
+        with transaction.atomic():
+            slugs = self.seed(options['recipes'], options['tags'])
+            self.stdout.write(f'{"tags":>4}  {"join any":>12}  '
+                              f'{"subquery any":>12}  {"join all":>12}  '
+                              f'{"subquery all":>12}')
+            for count in (1, 2, 3):
+                selected = slugs[:count]
+                self.check_results(selected)
+                timings = [
+                    self.measure(self.join(selected, conjoined=False)),
+                    self.measure(self.subquery(selected, 'any')),
+                    self.measure(self.join(selected, conjoined=True)),
+                    self.measure(self.subquery(selected, 'all')),
+                ]
+                self.stdout.write(f'{count:>4}  ' + '  '.join(
+                    f'{timing:>10.2f}ms' for timing in timings))
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def join(slugs, conjoined):
+        """Прежний ModelMultipleChoiceFilter по tags__slug."""
+        queryset = Recipe.objects.all()
+        if conjoined:
+            for slug in slugs:
+                queryset = queryset.filter(tags__slug=slug)
+            return queryset
+        return queryset.filter(tags__slug__in=slugs).distinct()
+
+    @staticmethod
+    def subquery(slugs, mode):
+        data = QueryDict(mutable=True)
+        data.setlist('tags', slugs)
+        data['tags_mode'] = mode
+        return RecipesFilter(data, queryset=Recipe.objects.all()).qs
+
+    def check_results(self, slugs):
+        for conjoined, mode in ((False, 'any'), (True, 'all')):
+            expected = self.join(slugs, conjoined).count()
+            if self.subquery(slugs, mode).count() != expected:
+                raise CommandError(
+                    f'Фильтр tags_mode={mode} расходится с JOIN')
+
+    def measure(self, queryset):
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            queryset.count()
+            list(queryset.order_by('-pub_date', '-id').values_list(
+                'pk', flat=True)[:self.limit])
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    @staticmethod
+    def seed(recipes, tags):
+        """Каждому рецепту достаётся от одного до четырёх случайных тегов."""
+        author = User.objects.create(username='benchmark_author',
+                                     email='benchmark_author@example.com')
+        created_tags = Tag.objects.bulk_create([
+            Tag(name=f'benchmark {number}', slug=f'benchmark-{number}',
+                color=f'#b{number:05x}')
+            for number in range(tags)])
+        Recipe.objects.bulk_create(
+            [Recipe(author=author, name=f'benchmark {number}',
+                    text='benchmark', cooking_time=1)
+             for number in range(recipes)],
+            batch_size=BATCH_SIZE)
+        tag_ids = list(Tag.objects.filter(
+            slug__startswith='benchmark-').values_list('pk', flat=True))
+        links = [
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in Recipe.objects.filter(
+                author=author).values_list('pk', flat=True)
+            for tag_id in random.sample(tag_ids, random.randint(1, 4))
+        ]
+        Recipe.tags.through.objects.bulk_create(links, batch_size=BATCH_SIZE)
+        # bulk_create не отправляет сигналы, словарь slug устарел
+        bump_version(TAGS_NAMESPACE)
+        return [tag.slug for tag in created_tags]
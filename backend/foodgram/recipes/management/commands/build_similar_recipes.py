@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.similarity import build_all
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает таблицу похожих рецептов по сходству '
+            'ингредиентов и тегов.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = build_all()
+        self.stdout.write(self.style.SUCCESS(
+            f'Соседи посчитаны для {count} рецептов '
+            f'за {time.monotonic() - started:.1f} с'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.renditions import generate
+
+
+class Command(BaseCommand):
+    help = 'Создаёт недостающие WebP-версии картинок рецептов.'
+
+    def handle(self, *args, **options):
+        names = Recipe.objects.exclude(image='').exclude(
+            image__isnull=True).values_list('image', flat=True).distinct()
+        for name in names.iterator():
+            generate(name)
+            self.stdout.write(name)
@@ -1,17 +1,125 @@
 import csv
+import json
+import os
+import time
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
+from recipes.autocomplete import ingredient_index
+from recipes.cache import INGREDIENTS_NAMESPACE, bump_version
 from recipes.models import Ingredient
 
+DEFAULT_PATH = 'static/data/ingredients.csv'
+READ_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) == 2:
+            yield row
+        else:
+            yield None
+
+
+def read_json(file):
+    """Читает JSON-массив объектов по частям, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    eof = False
+    while True:
+        buffer = buffer.lstrip(' \t\r\n,')
+        if not started and buffer.startswith('['):
+            started = True
+            buffer = buffer[1:].lstrip(' \t\r\n,')
+        if started and buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                if buffer:
+                    raise CommandError('Некорректный JSON в конце файла')
+                return
+            chunk = file.read(READ_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        buffer = buffer[end:]
+        if isinstance(item, dict):
+            yield item.get('name'), item.get('measurement_unit')
+        else:
+            yield None
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
 
 class Command(BaseCommand):
+    help = ('Загружает ингредиенты из CSV (name,measurement_unit) '
+            'или JSON-массива пачками через bulk_create.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=[DEFAULT_PATH])
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true')
 
     def handle(self, *args, **options):
-        with open('static/data/ingredients.csv', encoding='utf-8') as file:
-            csv_list = csv.reader(file)
-            for row in csv_list:
-                name, measurement_unit = row
-                Ingredient.objects.get_or_create(
-                    name=name,
-                    measurement_unit=measurement_unit)
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть больше нуля')
+        dry_run = options['dry_run']
+        for path in options['paths']:
+            reader = READERS.get(os.path.splitext(path)[1].lower())
+            if reader is None:
+                raise CommandError(f'Неизвестный формат файла: {path}')
+            if not os.path.exists(path):
+                raise CommandError(f'Файл не найден: {path}')
+            self.load(path, reader, batch_size, dry_run)
+        if not dry_run:
+            bump_version(INGREDIENTS_NAMESPACE)
+            ingredient_index.invalidate()
+
+    def load(self, path, reader, batch_size, dry_run):
+        before = Ingredient.objects.count()
+        seen = set()
+        batch = []
+        rows = skipped = 0
+        started = time.monotonic()
+        with open(path, encoding='utf-8') as file:
+            for row in reader(file):
+                rows += 1
+                name, measurement_unit = row or (None, None)
+                if not name or not measurement_unit:
+                    skipped += 1
+                    continue
+                key = (name.strip(), measurement_unit.strip())
+                if key in seen:
+                    continue
+                seen.add(key)
+                batch.append(Ingredient(name=key[0],
+                                        measurement_unit=key[1]))
+                if len(batch) >= batch_size:
+                    self.flush(batch, dry_run)
+                    batch = []
+                    self.report(path, rows, started)
+        self.flush(batch, dry_run)
+        self.report(path, rows, started)
+        created = 0 if dry_run else Ingredient.objects.count() - before
+        self.stdout.write(self.style.SUCCESS(
+            f'{path}: строк {rows}, уникальных {len(seen)}, '
+            f'пропущено {skipped}, добавлено {created}'
+            f'{" (dry-run)" if dry_run else ""}'))
+
+    @staticmethod
+    def flush(batch, dry_run):
+        if batch and not dry_run:
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+
+    def report(self, path, rows, started):
+        elapsed = time.monotonic() - started
+        rate = rows / elapsed if elapsed else rows
+        self.stdout.write(f'{path}: {rows} строк, {rate:.0f} строк/с')
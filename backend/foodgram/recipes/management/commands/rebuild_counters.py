@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики избранного, списков покупок, '
+            'рецептов и подписчиков, а также рейтинг trending.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_counters()
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.documents import refresh_recipe_documents
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает документы рецептов, из которых отдаются лента, '
+            'карточка и подбор рецептов.')
+
+    def handle(self, *args, **options):
+        recipe_ids = list(Recipe.objects.order_by('pk').values_list(
+            'pk', flat=True))
+        refresh_recipe_documents(recipe_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Документы рецептов пересобраны: {len(recipe_ids)}'))
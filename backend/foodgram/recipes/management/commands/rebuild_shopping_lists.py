@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.shopping_list import find_mismatches, rebuild_shopping_lists
+
+
+class Command(BaseCommand):
+    help = ('Сверяет списки покупок с корзинами и пересобирает их. '
+            'С --check только сообщает о расхождениях.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только проверить, ничего не меняя')
+
+    def handle(self, *args, **options):
+        mismatches = find_mismatches()
+        for user_id, ingredient_id in mismatches[:20]:
+            self.stdout.write(f'Пользователь {user_id}, ингредиент '
+                              f'{ingredient_id}: строка расходится')
+        if options['check']:
+            if mismatches:
+                raise CommandError(
+                    f'Расхождений в списках покупок: {len(mismatches)}')
+            self.stdout.write(self.style.SUCCESS(
+                'Списки покупок совпадают с корзинами'))
+            return
+        with transaction.atomic():
+            rebuild_shopping_lists()
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересобраны, исправлено строк: '
+            f'{len(mismatches)}'))
@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+
+from foodgram.routers import fresh_reads
+
+from .cache import RECIPE_INGREDIENTS_NAMESPACE, bump_version, get_version
+from .models import RecipeIngredientAmount
+
+CHANGE_KEY = 'recipe_ingredients:change:{}'
+EMPTY = np.empty(0, dtype=np.int32)
+
+
+def record_change(recipe_ids):
+    """Сообщает индексам всех процессов, чей состав изменился.
+
+    Каждое изменение получает свою версию, а список рецептов кладётся
+    в кеш под этой версией: индекс, отставший на несколько версий,
+    перечитывает из базы только эти рецепты."""
+    recipe_ids = sorted(set(recipe_ids))
+    if recipe_ids:
+        version = bump_version(RECIPE_INGREDIENTS_NAMESPACE)
+        cache.set(CHANGE_KEY.format(version), recipe_ids,
+                  settings.RECIPE_MATCH_INDEX_TTL)
+
+
+class RecipeMatchIndex:
+    """Обратный индекс «ингредиент → рецепты» в памяти процесса для
+    подбора рецептов по имеющимся продуктам.
+
+    Рецепты пронумерованы позициями, для каждого ингредиента хранится
+    массив int32 позиций рецептов, где он встречается. Число совпадений
+    для набора продуктов — np.bincount по склеенным массивам этих
+    ингредиентов, без GROUP BY по таблице состава. Изменения применяются
+    по журналу record_change, полная пересборка — при разрыве журнала
+    и не реже раза в RECIPE_MATCH_INDEX_TTL секунд."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._built_at = 0
+
+    def invalidate(self):
+        self._version = None
+
+    def warm(self):
+        try:
+            with self._lock:
+                self._refresh()
+        except DatabaseError:
+            self.invalidate()
+
+    def _build(self, version):
+        self._positions = {}
+        self._recipe_ids = []
+        self._recipe_ingredients = {}
+        postings = defaultdict(list)
+        rows = RecipeIngredientAmount.objects.order_by().values_list(
+            'recipe_id', 'ingredient_id')
+        for recipe_id, ingredient_id in rows.iterator(chunk_size=10000):
+            position = self._get_position(recipe_id)
+            postings[ingredient_id].append(position)
+            self._recipe_ingredients.setdefault(recipe_id, []).append(
+                ingredient_id)
+        self._postings = {
+            ingredient_id: np.array(recipe_positions, dtype=np.int32)
+            for ingredient_id, recipe_positions in postings.items()
+        }
+        self._sizes = np.zeros(len(self._recipe_ids), dtype=np.int32)
+        for recipe_id, ingredients in self._recipe_ingredients.items():
+            self._sizes[self._positions[recipe_id]] = len(ingredients)
+        self._ids = np.array(self._recipe_ids, dtype=np.int64)
+        self._version = version
+        self._built_at = time.monotonic()
+
+    def _get_position(self, recipe_id):
+        position = self._positions.get(recipe_id)
+        if position is None:
+            position = self._positions[recipe_id] = len(self._recipe_ids)
+            self._recipe_ids.append(recipe_id)
+        return position
+
+    def _apply(self, recipe_ids):
+        """Перечитывает состав рецептов recipe_ids из базы."""
+        current = defaultdict(list)
+        for recipe_id, ingredient_id in RecipeIngredientAmount.objects.filter(
+                recipe_id__in=recipe_ids).order_by().values_list(
+                'recipe_id', 'ingredient_id'):
+            current[recipe_id].append(ingredient_id)
+        for recipe_id in recipe_ids:
+            position = self._get_position(recipe_id)
+            for ingredient_id in self._recipe_ingredients.pop(recipe_id, ()):
+                recipe_positions = self._postings[ingredient_id]
+                self._postings[ingredient_id] = recipe_positions[
+                    recipe_positions != position]
+            ingredients = current.get(recipe_id, [])
+            for ingredient_id in ingredients:
+                self._postings[ingredient_id] = np.append(
+                    self._postings.get(ingredient_id, EMPTY),
+                    np.int32(position))
+            if ingredients:
+                self._recipe_ingredients[recipe_id] = ingredients
+        # Массивы не меняются на месте: match читает их после снятия блокировки
+        sizes = np.zeros(len(self._recipe_ids), dtype=np.int32)
+        sizes[:len(self._sizes)] = self._sizes
+        for recipe_id in recipe_ids:
+            sizes[self._positions[recipe_id]] = len(current.get(recipe_id, ()))
+        self._sizes = sizes
+        self._ids = np.array(self._recipe_ids, dtype=np.int64)
+
+    def _refresh(self):
+        version = get_version(RECIPE_INGREDIENTS_NAMESPACE)
+        with fresh_reads(RECIPE_INGREDIENTS_NAMESPACE):
+            self._refresh_to(version)
+
+    def _refresh_to(self, version):
+        if (self._version is None or version < self._version
+                or time.monotonic() - self._built_at
+                > settings.RECIPE_MATCH_INDEX_TTL):
+            self._build(version)
+            return
+        missed = range(self._version + 1, version + 1)
+        if not missed:
+            return
+        changes = None
+        if len(missed) <= settings.RECIPE_MATCH_MAX_REPLAY:
+            changes = cache.get_many(
+                [CHANGE_KEY.format(number) for number in missed])
+        if changes is None or len(changes) < len(missed):
+            self._build(version)
+            return
+        self._apply(sorted({recipe_id for recipe_ids in changes.values()
+                            for recipe_id in recipe_ids}))
+        self._version = version
+
+    def match(self, ingredient_ids, limit):
+        """Рецепты, где есть хотя бы один из ingredient_ids, по убыванию
+        доли имеющихся ингредиентов, затем числа совпадений.
+        Возвращает список (id рецепта, совпало, всего ингредиентов)."""
+        with self._lock:
+            self._refresh()
+            recipe_positions = [self._postings[ingredient_id]
+                                for ingredient_id in set(ingredient_ids)
+                                if ingredient_id in self._postings]
+            if not recipe_positions:
+                return []
+            matched = np.bincount(np.concatenate(recipe_positions),
+                                  minlength=len(self._sizes))
+            sizes, recipe_ids = self._sizes, self._ids
+        candidates = np.flatnonzero(matched)
+        coverage = matched[candidates] / sizes[candidates]
+        # lexsort сортирует по последнему ключу первым
+        order = np.lexsort((-recipe_ids[candidates], -matched[candidates],
+                            -coverage))[:limit]
+        return [
+            (int(recipe_ids[position]), int(matched[position]),
+             int(sizes[position]))
+            for position in candidates[order]
+        ]
+
+
+recipe_match_index = RecipeMatchIndex()
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.19 on 2026-10-17 04:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date'], name='recipe_author_pub_date_idx'),
+        ),
+    ]
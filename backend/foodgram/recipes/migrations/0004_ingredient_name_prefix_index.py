@@ -0,0 +1,33 @@
+# Generated by Django 3.2.19 on 2026-10-17 04:20
+
+from django.db import migrations
+
+# istartswith в PostgreSQL превращается в UPPER("name"::text) LIKE UPPER(%s).
+# Индекс по тому же выражению с text_pattern_ops работает для LIKE 'X%'
+# при любой collation базы. В SQLite такого индекса нет, операция пропускается.
+CREATE_INDEX = (
+    'CREATE INDEX IF NOT EXISTS ingredient_name_upper_prefix_idx '
+    'ON recipes_ingredient (UPPER("name"::text) text_pattern_ops)'
+)
+DROP_INDEX = 'DROP INDEX IF EXISTS ingredient_name_upper_prefix_idx'
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_INDEX)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_recipe_recipe_author_pub_date_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.2.19 on 2026-10-17 04:19
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Сливает дубли (name, measurement_unit) в ингредиент с меньшим id,
+    перенося на него ссылки из рецептов, иначе ограничение не создать.
+    Если в рецепте есть оба ингредиента, количества складываются."""
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredientAmount = apps.get_model('recipes',
+                                            'RecipeIngredientAmount')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit').annotate(
+        keep_id=Min('id'), total=Count('id')).filter(total__gt=1)
+    for group in duplicates:
+        keep_id = group['keep_id']
+        duplicate_ids = Ingredient.objects.filter(
+            name=group['name'],
+            measurement_unit=group['measurement_unit']).exclude(
+            id=keep_id).values_list('id', flat=True)
+        for duplicate_id in list(duplicate_ids):
+            recipes_with_keep = RecipeIngredientAmount.objects.filter(
+                ingredient_id=keep_id).values('recipe_id')
+            merged = RecipeIngredientAmount.objects.filter(
+                ingredient_id=duplicate_id,
+                recipe_id__in=recipes_with_keep).values_list(
+                'recipe_id', 'amount')
+            for recipe_id, amount in list(merged):
+                RecipeIngredientAmount.objects.filter(
+                    recipe_id=recipe_id, ingredient_id=keep_id).update(
+                    amount=F('amount') + amount)
+            RecipeIngredientAmount.objects.filter(
+                ingredient_id=duplicate_id).exclude(
+                recipe_id__in=recipes_with_keep).update(ingredient_id=keep_id)
+            Ingredient.objects.filter(id=duplicate_id).delete()
+
+
+class Migration(migrations.Migration):
+    # В PostgreSQL ограничение нельзя создать в той же транзакции, где
+    # менялись строки таблицы (pending trigger events): слияние идёт
+    # в своей транзакции
+    atomic = False
+
+    dependencies = [
+        ('recipes', '0004_ingredient_name_prefix_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients,
+                             migrations.RunPython.noop, atomic=True),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='ingredient_name_unit_unique'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.19 on 2026-10-17 04:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_ingredient_name_unit_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['pub_date', 'id'], name='recipe_pub_date_id_idx'),
+        ),
+    ]
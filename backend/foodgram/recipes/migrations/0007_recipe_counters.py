@@ -0,0 +1,54 @@
+# Generated by Django 3.2.19 on 2026-10-17 04:25
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    User = apps.get_model('users', 'User')
+    Subscription = apps.get_model('users', 'Subscription')
+    Recipe.objects.update(
+        favorites_count=count_subquery(Favorite, 'recipe'),
+        carts_count=count_subquery(ShoppingCart, 'recipe'),
+    )
+    User.objects.update(
+        recipes_count=count_subquery(Recipe, 'author'),
+        subscribers_count=count_subquery(Subscription, 'author'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_pub_date_id_idx'),
+        ('users', '0003_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='carts_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Число добавлений в список покупок'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Число добавлений в избранное'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date'], name='recipe_popular_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
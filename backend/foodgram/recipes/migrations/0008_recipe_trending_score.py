@@ -0,0 +1,26 @@
+# Generated by Django 3.2.19 on 2026-10-17 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='trending_score',
+            field=models.FloatField(default=0, verbose_name='Рейтинг популярности с затуханием'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-trending_score', '-pub_date'], name='recipe_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['cooking_time', '-pub_date'], name='recipe_cooking_time_idx'),
+        ),
+    ]
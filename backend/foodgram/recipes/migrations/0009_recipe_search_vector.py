@@ -0,0 +1,71 @@
+# Generated by Django 3.2.19 on 2026-10-17 04:31
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+# В PostgreSQL документ хранится в search_vector с GIN-индексом.
+# В SQLite его заменяет виртуальная таблица FTS5 с rowid = id рецепта.
+PG_CREATE_INDEX = (
+    'CREATE INDEX IF NOT EXISTS recipe_search_vector_idx '
+    'ON recipes_recipe USING gin (search_vector)'
+)
+PG_DROP_INDEX = 'DROP INDEX IF EXISTS recipe_search_vector_idx'
+PG_FILL = (
+    'UPDATE recipes_recipe r SET search_vector = '
+    "setweight(to_tsvector(%(config)s::regconfig, r.name), 'A') || "
+    "setweight(to_tsvector(%(config)s::regconfig, coalesce(("
+    "SELECT string_agg(i.name, ' ') "
+    'FROM recipes_recipeingredientamount a '
+    'JOIN recipes_ingredient i ON i.id = a.ingredient_id '
+    "WHERE a.recipe_id = r.id), '')), 'B') || "
+    "setweight(to_tsvector(%(config)s::regconfig, r.text), 'C')"
+)
+SQLITE_CREATE_TABLE = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS recipes_recipe_search '
+    'USING fts5(name, text, ingredients)'
+)
+SQLITE_DROP_TABLE = 'DROP TABLE IF EXISTS recipes_recipe_search'
+SQLITE_FILL = (
+    'INSERT INTO recipes_recipe_search (rowid, name, text, ingredients) '
+    'SELECT r.id, r.name, r.text, ('
+    "SELECT group_concat(i.name, ' ') "
+    'FROM recipes_recipeingredientamount a '
+    'JOIN recipes_ingredient i ON i.id = a.ingredient_id '
+    'WHERE a.recipe_id = r.id) '
+    'FROM recipes_recipe r'
+)
+
+
+def create_search(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(PG_CREATE_INDEX)
+        schema_editor.execute(PG_FILL, {'config': settings.SEARCH_CONFIG})
+    elif vendor == 'sqlite':
+        schema_editor.execute(SQLITE_CREATE_TABLE)
+        schema_editor.execute(SQLITE_FILL)
+
+
+def drop_search(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(PG_DROP_INDEX)
+    elif vendor == 'sqlite':
+        schema_editor.execute(SQLITE_DROP_TABLE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_trending_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый документ'),
+        ),
+        migrations.RunPython(create_search, drop_search),
+    ]
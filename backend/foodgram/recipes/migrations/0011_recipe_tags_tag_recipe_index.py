@@ -0,0 +1,22 @@
+from django.db import migrations
+
+# Таблица связей recipes_recipe_tags создаётся ManyToManyField, поэтому
+# индекс добавляется SQL. Уникальное ограничение уже даёт индекс
+# (recipe_id, tag_id) для EXISTS по рецепту; (tag_id, recipe_id) покрывает
+# выборку рецептов по тегу без обращения к таблице.
+CREATE_INDEX = (
+    'CREATE INDEX IF NOT EXISTS recipe_tags_tag_recipe_idx '
+    'ON recipes_recipe_tags (tag_id, recipe_id)'
+)
+DROP_INDEX = 'DROP INDEX IF EXISTS recipe_tags_tag_recipe_idx'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_similarrecipe'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEX, DROP_INDEX),
+    ]
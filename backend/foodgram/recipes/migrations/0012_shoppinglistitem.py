@@ -0,0 +1,55 @@
+# Generated by Django 3.2.19 on 2026-10-17 04:55
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_shopping_lists(apps, schema_editor):
+    RecipeIngredientAmount = apps.get_model('recipes',
+                                            'RecipeIngredientAmount')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    rows = RecipeIngredientAmount.objects.filter(
+        recipe__in_shopping_carts__isnull=False
+    ).order_by().values(
+        'ingredient_id', user_id=F('recipe__in_shopping_carts__user')
+    ).annotate(
+        total=Coalesce(Sum('amount'), 0), recipes=Count('pk')
+    ).values_list('user_id', 'ingredient_id', 'total', 'recipes')
+    ShoppingListItem.objects.bulk_create(
+        [ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                          total_amount=total, recipes_count=recipes)
+         for user_id, ingredient_id, total, recipes in rows],
+        batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0011_recipe_tags_tag_recipe_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.PositiveIntegerField(default=0, verbose_name='Количество')),
+                ('recipes_count', models.PositiveIntegerField(default=0, verbose_name='Число рецептов с ингредиентом')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to=settings.AUTH_USER_MODEL, verbose_name='Владелец списка покупок')),
+            ],
+            options={
+                'verbose_name': 'Строка списка покупок',
+                'verbose_name_plural': 'Строки списков покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='shopping_list_item_unique'),
+        ),
+        migrations.RunPython(fill_shopping_lists, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.19 on 2026-10-17 05:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeDocument',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('body', models.TextField(verbose_name='JSON рецепта')),
+            ],
+            options={
+                'verbose_name': 'Документ рецепта',
+                'verbose_name_plural': 'Документы рецептов',
+            },
+        ),
+    ]
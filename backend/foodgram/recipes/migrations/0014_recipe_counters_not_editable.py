@@ -0,0 +1,28 @@
+# Generated by Django 3.2.19 on 2026-10-17 05:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipedocument'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число добавлений в список покупок'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число добавлений в избранное'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False, verbose_name='Рейтинг популярности с затуханием'),
+        ),
+    ]
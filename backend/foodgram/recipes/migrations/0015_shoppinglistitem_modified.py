@@ -0,0 +1,20 @@
+# Generated by Django 3.2.19 on 2026-10-17 05:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_recipe_counters_not_editable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoppinglistitem',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Дата изменения'),
+            preserve_default=False,
+        ),
+    ]
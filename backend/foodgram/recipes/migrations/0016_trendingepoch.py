@@ -0,0 +1,24 @@
+# Generated by Django 3.2.19 on 2026-10-17 05:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_shoppinglistitem_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingEpoch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('epoch', models.DateTimeField(verbose_name='Эпоха')),
+            ],
+            options={
+                'verbose_name': 'Эпоха рейтинга',
+                'verbose_name_plural': 'Эпохи рейтинга',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.19 on 2026-10-17 05:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_trendingepoch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='renditions',
+            field=models.JSONField(default=dict, editable=False, verbose_name='Готовые версии изображения'),
+        ),
+    ]
@@ -1,5 +1,10 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import (BooleanField, Exists, OuterRef, Prefetch,
+                              Subquery, Value)
+
+from users.models import Subscription
 
 User = get_user_model()
 
@@ -18,6 +23,10 @@ class Ingredient(models.Model):
         ordering = ['name']
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='ingredient_name_unit_unique')]
 
     def __str__(self):
         return self.name
@@ -48,6 +57,61 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def with_user_flags(self, user):
+        """Аннотирует рецепты флагами is_favorited и is_in_shopping_cart
+        для пользователя одним запросом на всю выборку."""
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField())
+            )
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')))
+        )
+
+    def with_document_flags(self, user):
+        """Флаги пользователя для наложения на документы рецептов:
+        избранное, корзина и подписка на автора в том же запросе."""
+        if user.is_anonymous:
+            is_subscribed = Value(False, output_field=BooleanField())
+        else:
+            is_subscribed = Exists(Subscription.objects.filter(
+                user=user, author=OuterRef('author')))
+        return self.with_user_flags(user).annotate(
+            is_subscribed=is_subscribed)
+
+    def optimized_for(self, user):
+        """Выборка для чтения рецептов: автор с флагом подписки, теги
+        и ингредиенты загружаются фиксированным числом запросов
+        независимо от размера страницы. Поисковый документ не читается."""
+        return self.with_user_flags(user).defer(
+            'search_vector'
+        ).prefetch_related(
+            Prefetch('author',
+                     queryset=User.objects.with_is_subscribed(user)),
+            'tags',
+            Prefetch('recipes',
+                     queryset=RecipeIngredientAmount.objects.select_related(
+                         'ingredient')),
+        )
+
+    def latest_per_author(self, limit):
+        """Оставляет не более limit последних рецептов каждого автора.
+
+        Коррелированный подзапрос с LIMIT выбирает те же строки, что и
+        ROW_NUMBER() OVER (PARTITION BY author_id), но, в отличие от оконной
+        функции, допускается Django 3.2 в WHERE. Вместе с Prefetch это один
+        запрос на всех авторов страницы."""
+        return self.filter(pk__in=Subquery(
+            Recipe.objects.filter(author=OuterRef('author')).order_by(
+                '-pub_date', '-pk').values('pk')[:limit]))
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -65,6 +129,11 @@ class Recipe(models.Model):
         null=True,
         verbose_name='Изображение рецепта'
     )
+    renditions = models.JSONField(
+        default=dict,
+        editable=False,
+        verbose_name='Готовые версии изображения'
+    )
     text = models.TextField(
         verbose_name='Текстовое описание'
     )
@@ -85,16 +154,107 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата и время публикации'
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число добавлений в избранное'
+    )
+    carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число добавлений в список покупок'
+    )
+    trending_score = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name='Рейтинг популярности с затуханием'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый документ'
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
+    COUNTER_FIELDS = ('favorites_count', 'carts_count', 'trending_score')
+    # Пишет только renditions.generate, тоже через UPDATE
+    GENERATED_FIELDS = ('renditions',)
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=('author', '-pub_date'),
+                         name='recipe_author_pub_date_idx'),
+            models.Index(fields=('pub_date', 'id'),
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=('-favorites_count', '-pub_date'),
+                         name='recipe_popular_idx'),
+            models.Index(fields=('-trending_score', '-pub_date'),
+                         name='recipe_trending_idx'),
+            models.Index(fields=('cooking_time', '-pub_date'),
+                         name='recipe_cooking_time_idx'),
+        ]
+
+    def save(self, *args, update_fields=None, **kwargs):
+        # Счётчики меняются только через UPDATE с F-выражениями: полное
+        # сохранение не должно затирать их значениями, прочитанными раньше
+        if update_fields is None and not self._state.adding:
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.COUNTER_FIELDS
+                and field.name not in self.GENERATED_FIELDS]
+        super().save(*args, update_fields=update_fields, **kwargs)
 
     def __str__(self):
         return self.name
 
 
+class RecipeDocument(models.Model):
+    """Представление рецепта в API без полей текущего пользователя.
+
+    Собирается RecipeSerializer после каждого изменения рецепта, его
+    тегов, состава и автора; ссылки на картинки хранятся без домена."""
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='document',
+        verbose_name='Рецепт'
+    )
+    body = models.TextField(
+        verbose_name='JSON рецепта'
+    )
+
+    class Meta:
+        verbose_name = 'Документ рецепта'
+        verbose_name_plural = 'Документы рецептов'
+
+    def __str__(self):
+        return f'Документ рецепта {self.recipe_id}'
+
+
+class TrendingEpoch(models.Model):
+    """Точка отсчёта рейтинга trending, единственная строка.
+
+    Вклад отметки удваивается за каждый период полураспада от эпохи;
+    counters.rebase_trending_scores сдвигает её вперёд, чтобы вклады
+    не выходили за пределы float."""
+    epoch = models.DateTimeField(
+        verbose_name='Эпоха'
+    )
+
+    class Meta:
+        verbose_name = 'Эпоха рейтинга'
+        verbose_name_plural = 'Эпохи рейтинга'
+
+    def __str__(self):
+        return f'{self.epoch:%Y-%m-%d %H:%M}'
+
+
 class RecipeIngredientAmount(models.Model):
     recipe = models.ForeignKey(
         Recipe,
@@ -185,3 +345,75 @@ class Favorite(models.Model):
 
     def __str__(self):
         return f'{self.user}:{self.recipe}'
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Владелец списка покупок',
+        related_name='shopping_list'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+        related_name='+'
+    )
+    total_amount = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество'
+    )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число рецептов с ингредиентом'
+    )
+    modified = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+
+    class Meta:
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Строки списков покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='shopping_list_item_unique')]
+
+    def __str__(self):
+        return f'{self.user}:{self.ingredient}'
+
+
+class SimilarRecipe(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='neighbours'
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Похожий рецепт',
+        related_name='+'
+    )
+    score = models.FloatField(
+        verbose_name='Сходство'
+    )
+
+    class Meta:
+        ordering = ['-score']
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('recipe', 'similar'),
+                name='similar_recipe_unique')]
+        indexes = [
+            models.Index(fields=('recipe', '-score'),
+                         name='similar_recipe_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe}:{self.similar}'
@@ -0,0 +1,121 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection
+from django.dispatch import Signal
+from PIL import Image
+
+from .cache import RECIPES_NAMESPACE, bump_version
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = {
+    'thumbnail': (320, 320),
+    'feed': (960, 960),
+}
+RENDITIONS_DIR = 'recipes/renditions'
+
+# Отправляется с name картинки, когда для неё созданы новые версии
+renditions_generated = Signal()
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_RENDITION_WORKERS,
+    thread_name_prefix='renditions')
+
+
+def rendition_name(name, rendition):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return f'{RENDITIONS_DIR}/{stem}_{rendition}.webp'
+
+
+def has_alpha(image):
+    return (image.mode in ('RGBA', 'LA', 'PA')
+            or 'transparency' in image.info)
+
+
+def render(name, renditions):
+    with default_storage.open(name) as file, Image.open(file) as source:
+        # WebP хранит прозрачность, её не нужно терять
+        source = source.convert('RGBA' if has_alpha(source) else 'RGB')
+        for rendition in renditions:
+            image = source.copy()
+            image.thumbnail(RENDITIONS[rendition])
+            buffer = io.BytesIO()
+            image.save(buffer, 'WEBP', quality=80)
+            default_storage.save(rendition_name(name, rendition),
+                                 ContentFile(buffer.getvalue()))
+
+
+def generate(name):
+    """Создаёт недостающие WebP-версии картинки и отмечает их в
+    Recipe.renditions всех рецептов с этой картинкой. Имена исходников
+    содержат хеш содержимого, поэтому одинаковые загрузки делят
+    одни и те же версии."""
+    missing = [rendition for rendition in RENDITIONS
+               if not default_storage.exists(rendition_name(name, rendition))]
+    if missing:
+        render(name, missing)
+    renditions = {rendition: rendition_name(name, rendition)
+                  for rendition in RENDITIONS}
+    updated = Recipe.objects.filter(image=name).exclude(
+        renditions=renditions).update(renditions=renditions)
+    if not missing and not updated:
+        return
+    # Закешированные страницы ленты должны получить ссылки на версии
+    # независимо от того, справились ли обработчики сигнала
+    bump_version(RECIPES_NAMESPACE)
+    # Ошибка одного обработчика не мешает остальным; send_robust
+    # сам пишет её в лог django.dispatch
+    renditions_generated.send_robust(sender=None, name=name)
+
+
+def _generate_logged(name):
+    try:
+        generate(name)
+    except Exception:
+        logger.exception('Не удалось создать версии картинки %s', name)
+
+
+def _generate_in_worker(name):
+    # Обработчики renditions_generated пишут в базу из потока пула:
+    # соединение потока не живёт дольше задачи
+    close_old_connections()
+    try:
+        _generate_logged(name)
+    finally:
+        connection.close()
+
+
+def schedule(name):
+    """Ставит картинку в очередь на создание версий.
+
+    SQLite не допускает параллельной записи из второго потока, поэтому
+    там версии создаются сразу в текущем потоке."""
+    if connection.vendor == 'sqlite':
+        _generate_logged(name)
+        return None
+    return executor.submit(_generate_in_worker, name)
+
+
+def get_rendition_urls(name, renditions, request=None):
+    """Ссылки на версии картинки name; None, пока версия не создана.
+
+    Готовые версии берутся из Recipe.renditions, без обращений к
+    хранилищу. После смены картинки там остаются версии прежней, пока
+    generate их не обновит: они не совпадают с именами версий name."""
+    urls = {}
+    for rendition in RENDITIONS:
+        path = rendition_name(name, rendition)
+        url = None
+        if renditions.get(rendition) == path:
+            url = default_storage.url(path)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+        urls[rendition] = url
+    return urls
@@ -0,0 +1,95 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import (Case, F, FloatField, OuterRef, Q, Subquery,
+                              Value, When)
+from django.db.models.functions import Coalesce
+
+from .models import Recipe, RecipeIngredientAmount
+
+# Виртуальная таблица FTS5 создаётся миграцией 0009 только в SQLite.
+# rowid в ней совпадает с id рецепта.
+FTS_TABLE = 'recipes_recipe_search'
+FTS_DELETE = f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({{ids}})'
+FTS_INSERT = (
+    f'INSERT INTO {FTS_TABLE} (rowid, name, text, ingredients) '
+    'SELECT r.id, r.name, r.text, ('
+    "SELECT group_concat(i.name, ' ') "
+    'FROM recipes_recipeingredientamount a '
+    'JOIN recipes_ingredient i ON i.id = a.ingredient_id '
+    'WHERE a.recipe_id = r.id) '
+    'FROM recipes_recipe r WHERE r.id IN ({ids})'
+)
+FTS_SEARCH = (
+    f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+    f'ORDER BY bm25({FTS_TABLE}, 10.0, 1.0, 5.0) LIMIT %s'
+)
+FTS_MAX_RESULTS = 1000
+WORD_RE = re.compile(r'\w+')
+
+
+def get_search_vector():
+    """Название важнее ингредиентов, ингредиенты важнее описания."""
+    config = settings.SEARCH_CONFIG
+    ingredients = Subquery(
+        RecipeIngredientAmount.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+    )
+    return (
+        SearchVector('name', weight='A', config=config)
+        + SearchVector(Coalesce(ingredients, Value('')), weight='B',
+                       config=config)
+        + SearchVector('text', weight='C', config=config)
+    )
+
+
+def refresh_search_documents(recipe_ids):
+    """Пересобирает поисковые документы рецептов после изменения
+    названия, описания или состава."""
+    recipe_ids = [int(pk) for pk in recipe_ids]
+    if not recipe_ids:
+        return
+    if connection.vendor == 'postgresql':
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            search_vector=get_search_vector())
+    elif connection.vendor == 'sqlite':
+        ids = ', '.join(map(str, recipe_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(FTS_DELETE.format(ids=ids))
+            cursor.execute(FTS_INSERT.format(ids=ids))
+
+
+def search_recipes(queryset, query):
+    """Оставляет подходящие рецепты, самые релевантные первыми."""
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(query, config=settings.SEARCH_CONFIG,
+                                   search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-rank', '-pub_date', '-id')
+    words = WORD_RE.findall(query)
+    if not words:
+        return queryset.none()
+    if connection.vendor != 'sqlite':
+        condition = Q()
+        for word in words:
+            condition &= Q(name__icontains=word) | Q(text__icontains=word)
+        return queryset.filter(condition)
+    # Каждое слово ищется как префикс, слова объединяются через AND
+    match = ' '.join('"{}"*'.format(word) for word in words)
+    with connection.cursor() as cursor:
+        cursor.execute(FTS_SEARCH, [match, FTS_MAX_RESULTS])
+        ranked = [row[0] for row in cursor.fetchall()]
+    return queryset.filter(pk__in=ranked).annotate(
+        rank=Case(
+            *[When(pk=pk, then=Value(-position))
+              for position, pk in enumerate(ranked)],
+            output_field=FloatField())
+    ).order_by('-rank', '-pub_date', '-id')
@@ -0,0 +1,110 @@
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import RecipeIngredientAmount, ShoppingCart, ShoppingListItem
+
+WRITE_BATCH_SIZE = 5000
+
+
+def get_amounts(recipe_ids):
+    """Состав рецептов recipe_ids: {id ингредиента: (сумма, число
+    рецептов)}."""
+    return {
+        ingredient_id: (total, recipes)
+        for ingredient_id, total, recipes in
+        RecipeIngredientAmount.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by().values('ingredient_id').annotate(
+            total=Coalesce(Sum('amount'), 0), recipes=Count('pk')
+        ).values_list('ingredient_id', 'total', 'recipes')
+    }
+
+
+def get_delta(amounts, index, sign):
+    return Case(
+        *[When(ingredient_id=ingredient_id, then=Value(sign * value[index]))
+          for ingredient_id, value in amounts.items()],
+        default=Value(0), output_field=IntegerField())
+
+
+def change_items(user_ids, amounts, sign):
+    """Прибавляет (sign=1) или вычитает (sign=-1) amounts из
+    get_amounts в списках покупок пользователей user_ids.
+
+    Недостающие строки сначала вставляются с нулями, поэтому сама
+    правка — один UPDATE через F() для всех пользователей сразу, без
+    чтения текущих значений. Строка, в которую не входит больше ни один
+    рецепт, удаляется. Дата изменения строк служит валидатором
+    скачиваемого списка покупок."""
+    if not user_ids or not amounts:
+        return
+    if sign > 0:
+        ShoppingListItem.objects.bulk_create(
+            [ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id)
+             for user_id in user_ids for ingredient_id in amounts],
+            batch_size=WRITE_BATCH_SIZE, ignore_conflicts=True)
+    items = ShoppingListItem.objects.filter(user_id__in=user_ids,
+                                            ingredient_id__in=amounts)
+    items.update(
+        total_amount=Greatest(
+            F('total_amount') + get_delta(amounts, 0, sign), 0),
+        recipes_count=Greatest(
+            F('recipes_count') + get_delta(amounts, 1, sign), 0),
+        modified=timezone.now(),
+    )
+    if sign < 0:
+        items.filter(recipes_count=0).delete()
+
+
+def change_cart(user_id, recipe_ids, sign):
+    """Рецепты recipe_ids добавлены в корзину пользователя или убраны
+    из неё."""
+    change_items([user_id], get_amounts(recipe_ids), sign)
+
+
+def change_recipe(recipe_id, amounts, sign):
+    """Состав рецепта изменился: amounts прибавляются или вычитаются
+    во всех корзинах, где он лежит."""
+    user_ids = list(ShoppingCart.objects.filter(
+        recipe_id=recipe_id).values_list('user_id', flat=True))
+    change_items(user_ids, amounts, sign)
+
+
+def expected_items():
+    """Строки списков покупок, посчитанные заново по корзинам:
+    {(id пользователя, id ингредиента): (сумма, число рецептов)}."""
+    rows = RecipeIngredientAmount.objects.filter(
+        recipe__in_shopping_carts__isnull=False
+    ).order_by().values(
+        'ingredient_id', user_id=F('recipe__in_shopping_carts__user')
+    ).annotate(
+        total=Coalesce(Sum('amount'), 0), recipes=Count('pk')
+    ).values_list('user_id', 'ingredient_id', 'total', 'recipes')
+    return {(user_id, ingredient_id): (total, recipes)
+            for user_id, ingredient_id, total, recipes in rows}
+
+
+def find_mismatches():
+    """Пары (пользователь, ингредиент), где таблица расходится
+    с корзинами."""
+    expected = expected_items()
+    actual = {
+        (user_id, ingredient_id): (total, recipes)
+        for user_id, ingredient_id, total, recipes in
+        ShoppingListItem.objects.values_list(
+            'user_id', 'ingredient_id', 'total_amount', 'recipes_count')
+    }
+    return sorted(key for key in expected.keys() | actual.keys()
+                  if expected.get(key) != actual.get(key))
+
+
+def rebuild_shopping_lists():
+    """Пересобирает все списки покупок по корзинам."""
+    ShoppingListItem.objects.all().delete()
+    ShoppingListItem.objects.bulk_create(
+        [ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                          total_amount=total, recipes_count=recipes)
+         for (user_id, ingredient_id), (total, recipes)
+         in expected_items().items()],
+        batch_size=WRITE_BATCH_SIZE)
@@ -0,0 +1,209 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from users.models import Subscription
+from .autocomplete import ingredient_index
+from .cache import (INGREDIENTS_NAMESPACE, RECIPES_NAMESPACE, TAGS_NAMESPACE,
+                    bump_on_commit, user_namespace)
+from .counters import change_counters, count_marks
+from .matching import record_change
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredientAmount,
+                     ShoppingCart, Tag)
+from .renditions import schedule
+from .search import refresh_search_documents
+from .shopping_list import change_cart, change_recipe
+from .similarity import schedule_on_commit as schedule_similarity
+
+User = get_user_model()
+
+# Пакетные операции с избранным и корзиной учитывают отметки сами,
+# одним запросом на всю пачку, а не по запросу на строку
+marks_in_bulk = ContextVar('marks_in_bulk', default=False)
+
+
+@contextmanager
+def handle_marks_in_bulk():
+    """Внутри блока удаление и создание отметок не меняют счётчики,
+    поколение пользователя и список покупок: это делает вызывающий."""
+    token = marks_in_bulk.set(True)
+    try:
+        yield
+    finally:
+        marks_in_bulk.reset(token)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    bump_on_commit(INGREDIENTS_NAMESPACE)
+    bump_on_commit(RECIPES_NAMESPACE)
+    ingredient_index.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(**kwargs):
+    bump_on_commit(TAGS_NAMESPACE)
+    bump_on_commit(RECIPES_NAMESPACE)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=RecipeIngredientAmount)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def invalidate_recipes(**kwargs):
+    bump_on_commit(RECIPES_NAMESPACE)
+
+
+@receiver(post_save, sender=Recipe)
+def schedule_image_renditions(instance, **kwargs):
+    if instance.image:
+        transaction.on_commit(partial(schedule, instance.image.name))
+
+
+@receiver(post_save, sender=User)
+def invalidate_authors(update_fields=None, **kwargs):
+    # Вход и смена пароля не меняют автора в выдаче рецептов
+    if update_fields is None or not set(update_fields) <= {'last_login',
+                                                           'password'}:
+        bump_on_commit(RECIPES_NAMESPACE)
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+@receiver((post_save, post_delete), sender=Subscription)
+def invalidate_user_pages(sender, instance, **kwargs):
+    if sender is not Subscription and marks_in_bulk.get():
+        return
+    bump_on_commit(user_namespace(instance.user_id))
+
+
+def get_delta(signal, created):
+    """+1 при создании записи, -1 при удалении, 0 при изменении."""
+    if signal is post_delete:
+        return -1
+    return 1 if created else 0
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def count_recipe_marks(sender, instance, signal, created=False, **kwargs):
+    delta = get_delta(signal, created)
+    if delta and not marks_in_bulk.get():
+        count_marks(sender, {instance.recipe_id: instance.added_date}, delta)
+
+
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def update_shopping_list(instance, signal, created=False, **kwargs):
+    delta = get_delta(signal, created)
+    if delta and not marks_in_bulk.get():
+        change_cart(instance.user_id, [instance.recipe_id], delta)
+
+
+@receiver(pre_save, sender=RecipeIngredientAmount)
+def remember_amount(instance, **kwargs):
+    # Без прежнего значения правку нельзя вычесть из списков покупок
+    instance._previous_amount = None
+    if not instance._state.adding:
+        instance._previous_amount = RecipeIngredientAmount.objects.filter(
+            pk=instance.pk).values_list(
+            'recipe_id', 'ingredient_id', 'amount').first()
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredientAmount)
+def update_amount_shopping_list(instance, signal, **kwargs):
+    # При каскадном удалении рецепта строки корзин и состава удаляются
+    # по очереди: вычитает тот обработчик, который сработал первым
+    previous = getattr(instance, '_previous_amount', None)
+    if signal is post_delete:
+        previous = instance.recipe_id, instance.ingredient_id, instance.amount
+    if previous is not None:
+        recipe_id, ingredient_id, amount = previous
+        change_recipe(recipe_id, {ingredient_id: (amount or 0, 1)}, -1)
+    if signal is post_save:
+        change_recipe(instance.recipe_id,
+                      {instance.ingredient_id: (instance.amount or 0, 1)}, 1)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def count_author_recipes(instance, signal, created=False, **kwargs):
+    delta = get_delta(signal, created)
+    if delta:
+        change_counters(User, instance.author_id, recipes_count=delta)
+
+
+@receiver((post_save, post_delete), sender=Subscription)
+def count_subscribers(instance, signal, created=False, **kwargs):
+    delta = get_delta(signal, created)
+    if delta:
+        change_counters(User, instance.author_id, subscribers_count=delta)
+
+
+def refresh_search_on_commit(get_recipe_ids):
+    transaction.on_commit(
+        lambda: refresh_search_documents(get_recipe_ids()))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def refresh_recipe_search(instance, **kwargs):
+    # Состав сохраняется bulk_create уже после рецепта, поэтому документ
+    # собирается после коммита. После удаления Django обнуляет pk.
+    recipe_ids = [instance.pk]
+    refresh_search_on_commit(lambda: recipe_ids)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredientAmount)
+def refresh_amount_search(instance, **kwargs):
+    refresh_search_on_commit(lambda: [instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def refresh_ingredients_search(instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        recipe_ids = list(pk_set or ()) if reverse else [instance.pk]
+        refresh_search_on_commit(lambda: recipe_ids)
+
+
+@receiver(post_save, sender=Ingredient)
+def refresh_ingredient_search(instance, created, **kwargs):
+    if not created:
+        refresh_search_on_commit(lambda: Recipe.objects.filter(
+            ingredients=instance).values_list('pk', flat=True))
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredientAmount)
+def record_amount_change(instance, **kwargs):
+    transaction.on_commit(partial(record_change, [instance.recipe_id]))
+
+
+@receiver(post_delete, sender=Recipe)
+def record_recipe_delete(instance, **kwargs):
+    transaction.on_commit(partial(record_change, [instance.pk]))
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def record_ingredients_change(instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        recipe_ids = list(pk_set or ()) if reverse else [instance.pk]
+        transaction.on_commit(partial(record_change, recipe_ids))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def update_recipe_similarity(instance, **kwargs):
+    schedule_similarity([instance.pk])
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredientAmount)
+def update_amount_similarity(instance, **kwargs):
+    schedule_similarity([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def update_tags_similarity(instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        schedule_similarity(list(pk_set or ()) if reverse else [instance.pk])
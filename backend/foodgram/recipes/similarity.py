@@ -0,0 +1,338 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from scipy import sparse
+
+from foodgram.routers import fresh_reads
+
+from .cache import SIMILAR_FEATURES_NAMESPACE, bump_version, get_version
+from .models import Recipe, RecipeIngredientAmount, SimilarRecipe
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 256
+WRITE_BATCH_SIZE = 5000
+CHANGE_KEY = 'similar_features:change:{}'
+
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='similar')
+_pending = set()
+_pending_lock = threading.Lock()
+_collected = threading.local()
+
+
+def read_features(recipe_ids=None):
+    """Признаки рецептов recipe_ids (по умолчанию всех): id найденных
+    рецептов по возрастанию, пары (id рецепта, ключ признака) и их веса.
+
+    Ключ ингредиента — его id × 2, тега — id × 2 + 1: ключи не зависят
+    от состава базы и не меняются при частичном обновлении. Ингредиенты
+    весят 1, теги — SIMILAR_RECIPES_TAG_WEIGHT."""
+    recipes = Recipe.objects.order_by('pk')
+    ingredients = RecipeIngredientAmount.objects.order_by()
+    tags = Recipe.tags.through.objects.order_by()
+    if recipe_ids is not None:
+        recipes = recipes.filter(pk__in=recipe_ids)
+        ingredients = ingredients.filter(recipe_id__in=recipe_ids)
+        tags = tags.filter(recipe_id__in=recipe_ids)
+    ids = np.fromiter(recipes.values_list('pk', flat=True), dtype=np.int64)
+    ingredients = np.array(ingredients.values_list(
+        'recipe_id', 'ingredient_id'), dtype=np.int64).reshape(-1, 2)
+    tags = np.array(tags.values_list(
+        'recipe_id', 'tag_id'), dtype=np.int64).reshape(-1, 2)
+    features = np.concatenate([ingredients * [1, 2], tags * [1, 2] + [0, 1]])
+    weights = np.concatenate([
+        np.ones(len(ingredients), dtype=np.float32),
+        np.full(len(tags), settings.SIMILAR_RECIPES_TAG_WEIGHT,
+                dtype=np.float32)])
+    # Рецепт мог появиться или исчезнуть между запросами
+    known = np.isin(features[:, 0], ids)
+    return ids, features[known], weights[known]
+
+
+def normalize(matrix):
+    """Строки делятся на свою длину, поэтому произведение строк —
+    косинусное сходство."""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms).dot(matrix).tocsr()
+
+
+def load_features():
+    """Матрица признаков всех рецептов: строка — рецепт, столбцы — его
+    ингредиенты и теги. Возвращает матрицу, id рецептов по строкам
+    и номера столбцов по ключам признаков."""
+    recipe_ids, features, weights = read_features()
+    keys, columns = np.unique(features[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (weights, (np.searchsorted(recipe_ids, features[:, 0]), columns)),
+        shape=(len(recipe_ids), len(keys)), dtype=np.float32)
+    return normalize(matrix), recipe_ids, dict(
+        zip(keys.tolist(), range(len(keys))))
+
+
+def record_change(recipe_ids):
+    """Сообщает матрицам признаков других процессов, какие рецепты
+    перечитать, и возвращает версию изменения."""
+    version = bump_version(SIMILAR_FEATURES_NAMESPACE)
+    cache.set(CHANGE_KEY.format(version), sorted(recipe_ids),
+              settings.SIMILAR_RECIPES_INDEX_TTL)
+    return version
+
+
+class FeatureMatrix:
+    """Матрица признаков рецептов в памяти процесса.
+
+    Целиком загружается один раз, после изменения рецептов из базы
+    перечитываются только их строки. Изменения из других процессов
+    применяются по журналу record_change, полная перезагрузка — при
+    разрыве журнала и не реже раза в SIMILAR_RECIPES_INDEX_TTL секунд.
+    Матрица не меняется на месте: выданную update можно читать после
+    снятия блокировки."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._built_at = 0
+
+    def invalidate(self):
+        self._version = None
+
+    def _build(self, version):
+        self._matrix, recipe_ids, self._columns = load_features()
+        self._recipe_ids = recipe_ids.tolist()
+        self._positions = {
+            recipe_id: position
+            for position, recipe_id in enumerate(self._recipe_ids)}
+        self._ids = recipe_ids
+        self._version = version
+        self._built_at = time.monotonic()
+
+    def _apply(self, recipe_ids):
+        """Перечитывает строки рецептов recipe_ids; строки удалённых
+        рецептов обнуляются."""
+        present, features, weights = read_features(recipe_ids)
+        for recipe_id in present.tolist():
+            if recipe_id not in self._positions:
+                self._positions[recipe_id] = len(self._recipe_ids)
+                self._recipe_ids.append(recipe_id)
+        rows = [self._positions[recipe_id] for recipe_id in recipe_ids
+                if recipe_id in self._positions]
+        columns = [self._columns.setdefault(key, len(self._columns))
+                   for key in features[:, 1].tolist()]
+        shape = (len(self._recipe_ids), len(self._columns))
+        old = self._matrix
+        indptr = np.concatenate([
+            old.indptr,
+            np.full(shape[0] - old.shape[0], old.indptr[-1],
+                    dtype=old.indptr.dtype)])
+        old = sparse.csr_matrix((old.data, old.indices, indptr), shape=shape)
+        kept = np.ones(shape[0], dtype=np.float32)
+        kept[rows] = 0
+        changed = sparse.csr_matrix(
+            (weights, ([self._positions[recipe_id]
+                        for recipe_id in features[:, 0].tolist()], columns)),
+            shape=shape, dtype=np.float32)
+        self._matrix = (sparse.diags(kept).dot(old)
+                        + normalize(changed)).tocsr()
+        self._ids = np.array(self._recipe_ids, dtype=np.int64)
+        return present
+
+    def _refresh_to(self, version):
+        if (self._version is None or version < self._version
+                or time.monotonic() - self._built_at
+                > settings.SIMILAR_RECIPES_INDEX_TTL):
+            self._build(version)
+            return
+        missed = range(self._version + 1, version + 1)
+        if not missed:
+            return
+        changes = None
+        if len(missed) <= settings.SIMILAR_RECIPES_MAX_REPLAY:
+            changes = cache.get_many(
+                [CHANGE_KEY.format(number) for number in missed])
+        if changes is None or len(changes) < len(missed):
+            self._build(version)
+            return
+        self._apply(sorted({recipe_id for recipe_ids in changes.values()
+                            for recipe_id in recipe_ids}))
+        self._version = version
+
+    def update(self, recipe_ids):
+        """Применяет изменения рецептов recipe_ids и возвращает матрицу,
+        id рецептов по её строкам и строки тех из recipe_ids, что ещё
+        существуют."""
+        recipe_ids = sorted(recipe_ids)
+        with self._lock:
+            with fresh_reads(SIMILAR_FEATURES_NAMESPACE):
+                self._refresh_to(get_version(SIMILAR_FEATURES_NAMESPACE))
+                present = self._apply(recipe_ids)
+            version = record_change(recipe_ids)
+            # Иначе между версиями есть чужие изменения: они применятся
+            # из журнала при следующем обновлении
+            if version == self._version + 1:
+                self._version = version
+            positions = np.array(
+                [self._positions[recipe_id] for recipe_id in present.tolist()],
+                dtype=np.int64)
+            return self._matrix, self._ids, positions
+
+
+feature_matrix = FeatureMatrix()
+
+
+def top_neighbours(scores, positions, limit):
+    """Для каждой строки scores — до limit столбцов с наибольшим
+    сходством, кроме самого рецепта и нулевых."""
+    scores[np.arange(len(positions)), positions] = 0
+    limit = min(limit, scores.shape[1])
+    if not limit:
+        return []
+    best = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+    result = []
+    for row, columns in enumerate(best):
+        columns = columns[np.argsort(-scores[row, columns], kind='stable')]
+        result.append([(column, scores[row, column]) for column in columns
+                       if scores[row, column] > 0])
+    return result
+
+
+def iter_neighbours(matrix, recipe_ids, positions, limit):
+    for start in range(0, len(positions), BLOCK_SIZE):
+        block = positions[start:start + BLOCK_SIZE]
+        # Популярные ингредиенты делают блок сходств почти плотным, поэтому
+        # разреженная матрица умножается на плотный блок
+        scores = np.ascontiguousarray(
+            matrix.dot(matrix[block].toarray().T).T)
+        for position, neighbours in zip(
+                block, top_neighbours(scores, block, limit)):
+            yield int(recipe_ids[position]), [
+                (int(recipe_ids[column]), float(score))
+                for column, score in neighbours]
+
+
+def build_all():
+    """Пересчитывает всю таблицу соседей."""
+    matrix, recipe_ids, _ = load_features()
+    limit = settings.SIMILAR_RECIPES_TOP_K
+    with transaction.atomic():
+        SimilarRecipe.objects.all().delete()
+        batch = []
+        for recipe_id, neighbours in iter_neighbours(
+                matrix, recipe_ids, np.arange(len(recipe_ids)), limit):
+            batch.extend(
+                SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id,
+                              score=score)
+                for similar_id, score in neighbours)
+            if len(batch) >= WRITE_BATCH_SIZE:
+                SimilarRecipe.objects.bulk_create(batch)
+                batch = []
+        SimilarRecipe.objects.bulk_create(batch)
+    # Версия без записи в журнале: матрицы всех процессов перезагрузятся
+    bump_version(SIMILAR_FEATURES_NAMESPACE)
+    return len(recipe_ids)
+
+
+def update(changed_ids):
+    """Пересчитывает соседей изменённых рецептов по матрице признаков
+    процесса и вставляет их в списки тех рецептов, в чей топ они теперь
+    попадают.
+
+    Рецепт, который выпал из чужого топа, просто удаляется оттуда: до
+    следующего build_similar_recipes такой список может быть короче."""
+    matrix, recipe_ids, positions = feature_matrix.update(changed_ids)
+    limit = settings.SIMILAR_RECIPES_TOP_K
+    results = list(iter_neighbours(matrix, recipe_ids, positions, limit))
+    # Рецепт мог быть удалён в другом процессе, который ещё не записал
+    # изменение в журнал
+    existing = set(Recipe.objects.filter(pk__in={
+        similar_id for _, neighbours in results
+        for similar_id, _ in neighbours}).values_list('pk', flat=True))
+    with transaction.atomic():
+        for recipe_id, neighbours in results:
+            neighbours = [(similar_id, score) for similar_id, score
+                          in neighbours if similar_id in existing]
+            SimilarRecipe.objects.filter(recipe_id=recipe_id).delete()
+            SimilarRecipe.objects.filter(similar_id=recipe_id).delete()
+            SimilarRecipe.objects.bulk_create([
+                SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id,
+                              score=score)
+                for similar_id, score in neighbours])
+            add_reverse(recipe_id, neighbours, limit)
+
+
+def add_reverse(recipe_id, neighbours, limit):
+    # Сходство симметрично: сосед рецепта может получить его в свой топ
+    lists = {}
+    for owner_id, similar_id, score in SimilarRecipe.objects.filter(
+            recipe_id__in=[similar_id for similar_id, _ in neighbours]
+    ).values_list('recipe_id', 'similar_id', 'score'):
+        lists.setdefault(owner_id, []).append((score, similar_id))
+    created = []
+    dropped = []
+    for owner_id, score in neighbours:
+        current = sorted(lists.get(owner_id, []), reverse=True)
+        if len(current) < limit:
+            created.append(SimilarRecipe(recipe_id=owner_id,
+                                         similar_id=recipe_id, score=score))
+        elif score > current[limit - 1][0]:
+            created.append(SimilarRecipe(recipe_id=owner_id,
+                                         similar_id=recipe_id, score=score))
+            dropped.append((owner_id, current[limit - 1][1]))
+    SimilarRecipe.objects.bulk_create(created)
+    for owner_id, similar_id in dropped:
+        SimilarRecipe.objects.filter(recipe_id=owner_id,
+                                     similar_id=similar_id).delete()
+
+
+def _update_pending():
+    with _pending_lock:
+        changed_ids = set(_pending)
+        _pending.clear()
+    try:
+        update(changed_ids)
+    except Exception:
+        logger.exception('Не удалось обновить похожие рецепты %s',
+                         sorted(changed_ids))
+    finally:
+        connection.close()
+
+
+def schedule(recipe_ids):
+    """Ставит рецепты в очередь на пересчёт соседей. Изменения,
+    накопившиеся до запуска задачи, пересчитываются одним проходом.
+
+    SQLite не допускает параллельной записи из второго потока, поэтому
+    там пересчёт выполняется сразу в текущем потоке."""
+    if connection.vendor == 'sqlite':
+        update(set(recipe_ids))
+        return None
+    with _pending_lock:
+        submit = not _pending
+        _pending.update(recipe_ids)
+    if submit:
+        return executor.submit(_update_pending)
+    return None
+
+
+def schedule_on_commit(recipe_ids):
+    """Ставит рецепты в очередь после коммита. Все изменения транзакции
+    собираются в один вызов: правка рецепта меняет и сам рецепт,
+    и теги, и состав."""
+    collected = getattr(_collected, 'recipe_ids', None)
+    if collected is None:
+        collected = _collected.recipe_ids = set()
+    collected.update(recipe_ids)
+    transaction.on_commit(_flush_collected)
+
+
+def _flush_collected():
+    recipe_ids = getattr(_collected, 'recipe_ids', None)
+    _collected.recipe_ids = set()
+    if recipe_ids:
+        schedule(recipe_ids)
@@ -0,0 +1,37 @@
+from itertools import groupby
+from operator import itemgetter
+
+# Единица измерения: (каноническая единица, сколько в ней канонических).
+# Ложки и стакан пересчитываются в миллилитры по кулинарным мерам.
+UNIT_CONVERSIONS = {
+    'г': ('г', 1),
+    'кг': ('г', 1000),
+    'мл': ('мл', 1),
+    'л': ('мл', 1000),
+    'ч. л.': ('мл', 5),
+    'ст. л.': ('мл', 15),
+    'стакан': ('мл', 250),
+}
+
+
+def normalize_unit(unit):
+    """Каноническая единица и множитель; единицы без пересчёта (шт.,
+    по вкусу, пучок) остаются как есть."""
+    return UNIT_CONVERSIONS.get(unit.strip().lower(), (unit, 1))
+
+
+def normalize_rows(rows):
+    """Сводит строки (название, единица, количество), упорядоченные по
+    названию, к каноническим единицам: 1 кг и 500 г одного продукта
+    дают 1500 г.
+
+    Строки одного продукта идут подряд, поэтому проход потоковый
+    и линейный: в памяти только единицы текущего продукта. Суммы —
+    целые Python, они не ограничены размером поля количества."""
+    for name, group in groupby(rows, key=itemgetter(0)):
+        totals = {}
+        for _, unit, amount in group:
+            unit, factor = normalize_unit(unit)
+            totals[unit] = totals.get(unit, 0) + (amount or 0) * factor
+        for unit, amount in totals.items():
+            yield name, unit, amount
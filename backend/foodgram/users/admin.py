@@ -7,6 +7,7 @@ from .models import Subscription, User
 class UserAdmin(admin.ModelAdmin):
     list_display = ('username', 'first_name', 'email',)
     list_filter = ('email', 'first_name',)
+    readonly_fields = ('recipes_count', 'subscribers_count')
     empty_value_display = '-пусто-'
 
 
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.19 on 2026-10-17 04:15
+
+from django.db import migrations
+import users.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', users.models.UsersManager()),
+            ],
+        ),
+    ]
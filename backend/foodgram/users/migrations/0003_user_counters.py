@@ -0,0 +1,23 @@
+# Generated by Django 3.2.19 on 2026-10-17 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_user_managers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Число рецептов'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Число подписчиков'),
+        ),
+    ]
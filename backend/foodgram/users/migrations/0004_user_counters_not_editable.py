@@ -0,0 +1,23 @@
+# Generated by Django 3.2.19 on 2026-10-17 05:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число рецептов'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число подписчиков'),
+        ),
+    ]
@@ -1,5 +1,21 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
+from django.db.models import BooleanField, Exists, OuterRef, Value
+
+
+class UserQuerySet(models.QuerySet):
+
+    def with_is_subscribed(self, user):
+        """Аннотирует пользователей флагом подписки на них user."""
+        if user.is_anonymous:
+            return self.annotate(
+                is_subscribed=Value(False, output_field=BooleanField()))
+        return self.annotate(is_subscribed=Exists(
+            Subscription.objects.filter(user=user, author=OuterRef('pk'))))
+
+
+class UsersManager(UserManager.from_queryset(UserQuerySet)):
+    pass
 
 
 class User(AbstractUser):
@@ -30,12 +46,36 @@ class User(AbstractUser):
         verbose_name='Фамилия',
         help_text='Введите фамилию. Обязательное поле.'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число рецептов'
+    )
+    subscribers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число подписчиков'
+    )
+
+    objects = UsersManager()
+
+    COUNTER_FIELDS = ('recipes_count', 'subscribers_count')
 
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
         ordering = ('username',)
 
+    def save(self, *args, update_fields=None, **kwargs):
+        # Счётчики меняются только через UPDATE с F-выражениями: полное
+        # сохранение не должно затирать их значениями, прочитанными раньше
+        if update_fields is None and not self._state.adding:
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.COUNTER_FIELDS]
+        super().save(*args, update_fields=update_fields, **kwargs)
+
     def __str__(self):
         return self.username
 